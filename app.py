@@ -3,6 +3,8 @@ from streamlit.errors import StreamlitSecretNotFoundError
 import pandas as pd
 import sqlite3
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import IsolationForest
 from fpdf import FPDF
@@ -15,15 +17,45 @@ from google.auth.transport import requests as google_requests
 import smtplib
 from email.message import EmailMessage
 import io
+import os
 import schedule
 import time
 import threading
 import folium
 from streamlit.components.v1 import html as st_html
 from streamlit_mic_recorder import speech_to_text
-from folium.plugins import HeatMap, TimestampedGeoJson
+from folium.plugins import TimestampedGeoJson
 import extra_streamlit_components as stx
 import html
+import hashlib
+import re
+from collections import OrderedDict
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from aqi_engine import CPCB_BREAKPOINTS, apply_cpcb_averaging, compute_aqi
+from db import (
+    POLLUTANT_COLUMNS,
+    ROLLUP_COLUMNS,
+    ROLLUP_PROJECTION,
+    connection,
+    migrate_air_quality_schema,
+    seed_setting,
+    sync_rollups,
+    transaction,
+)
+from ingest import CHUNK_ROWS, ingest_air_quality, ingest_csv, normalize_air_quality
+from stations import (
+    MAX_VIEW_ZOOM,
+    StationIndex,
+    cluster_points,
+    fit_view,
+    mercator_y,
+    migrate_stations_schema,
+    read_stations,
+    stations_generation,
+    viewport_bounds,
+)
 
 
 def get_secret(key, default=None):
@@ -62,6 +94,11 @@ def fetch_aqi_news(api_key):
 # ---------------- PAGE CONFIG ----------------
 st.set_page_config(page_title="AQI Dashboard", page_icon=None, layout="wide")
 
+# Copy-on-Write: slices of the shared AQI frame stay views until written to
+# (always enabled from pandas 3.0 onwards)
+if pd.__version__.startswith("2."):
+    pd.set_option("mode.copy_on_write", True)
+
 # ---------------- SESSION INIT ----------------
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
@@ -119,17 +156,89 @@ if st.button("Test OpenAI"):
             st.error(f"OpenAI request failed: {e}")
 
 
-# ---------------- LOCATION DETECTION ----------------
-def get_user_location():
+# ---------------- LOCATION LOOKUP ----------------
+# The app runs on a server, so the visitor's position can't come from an IP
+# lookup (that finds the server): the user enters a place name or "lat, lon".
+# Place names are geocoded with OpenStreetMap Nominatim, whose usage policy
+# requires a User-Agent identifying the application and a contact. Set it as
+# GEOCODER_USER_AGENT in Streamlit secrets, e.g.
+#     GEOCODER_USER_AGENT = "AQI Dashboard (admin@example.org)"
+# Without it only coordinates are accepted.
+COORDINATES_PATTERN = re.compile(
+    r"^\s*([-+]?\d+(?:\.\d+)?)\s*,\s*([-+]?\d+(?:\.\d+)?)\s*$"
+)
+GEOCODER_URL = "https://nominatim.openstreetmap.org/search"
+
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def geocode_place(query, user_agent):
+    # (label, lat, lon) of the best OpenStreetMap match for a place name, or
+    # None if there is none. Cached for a day, so a query is sent once rather
+    # than on every rerun (Nominatim allows about one request a second).
+    # Request errors raise instead, so they are not cached.
+    res = requests.get(
+        GEOCODER_URL,
+        params={"q": query, "format": "json", "limit": 1},
+        headers={"User-Agent": user_agent},
+        timeout=5,
+    )
+    res.raise_for_status()
+    results = res.json()
+    if not results:
+        return None
+    top = results[0]
+    label = ", ".join(top["display_name"].split(", ")[:2])
+    return label, float(top["lat"]), float(top["lon"])
+
+
+def resolve_location(text):
+    # (label, lat, lon) for "lat, lon" or a place name; raises ValueError
+    # with a message for the user when it can't be resolved
+    match = COORDINATES_PATTERN.match(text)
+    if match:
+        lat, lon = float(match.group(1)), float(match.group(2))
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return f"{lat:.4f}, {lon:.4f}", lat, lon
+        raise ValueError("Latitude must be within ±90 and longitude within ±180.")
+
+    user_agent = get_secret("GEOCODER_USER_AGENT")
+    if not user_agent:
+        raise ValueError(
+            "Place search needs `GEOCODER_USER_AGENT` in Streamlit secrets; "
+            "enter lat, lon instead."
+        )
     try:
-        res = requests.get("https://ipapi.co/json/", timeout=5)
-        data = res.json()
-        city = data.get("city", "Unknown")
-        region = data.get("region", "Unknown")
-        country = data.get("country_name", "Unknown")
-        return city, region, country
-    except:
-        return "Unknown", "Unknown", "Unknown"
+        location = geocode_place(text, user_agent)
+    except Exception as e:
+        print(f"Geocoding Error: {e}")
+        raise ValueError("Place search is unavailable; enter lat, lon instead.")
+    if location is None:
+        raise ValueError(f"Could not find '{text}'.")
+    return location
+
+
+def select_nearest_station(city_list):
+    # Sidebar button callback: pick the monitored city nearest to the
+    # location entered above the button
+    text = st.session_state.get("user_location", "").strip()
+    if not text:
+        st.session_state.location_note = "Enter a place name or lat, lon first."
+        return
+    try:
+        label, lat, lon = resolve_location(text)
+    except ValueError as e:
+        st.session_state.location_note = str(e)
+        return
+    nearest = get_station_index().nearest(lat, lon, cities=city_list)
+    if nearest.empty:
+        st.session_state.location_note = "No registered station has data yet."
+        return
+    station = nearest.iloc[0]
+    st.session_state.manual_city = station["City"]
+    st.session_state.location_note = (
+        f"Nearest station to {label}: {station['City']} "
+        f"({station['Distance_km']:.0f} km)"
+    )
 
 
 # ---------------- WEATHER API ----------------
@@ -156,41 +265,28 @@ def get_weather_data(city):
         return None
 
 
-# ---------------- CITY COORDINATES ----------------
-CITY_COORDINATES = {
-    "Ahmedabad": [23.0225, 72.5714],
-    "Aizawl": [23.7271, 92.7176],
-    "Amaravati": [16.5417, 80.5158],
-    "Amritsar": [31.6340, 74.8723],
-    "Bengaluru": [12.9716, 77.5946],
-    "Bhopal": [23.2599, 77.4126],
-    "Brajrajnagar": [21.8333, 83.9167],
-    "Chandigarh": [30.7333, 76.7794],
-    "Chennai": [13.0827, 80.2707],
-    "Coimbatore": [11.0168, 76.9558],
-    "Delhi": [28.6139, 77.2090],
-    "Ernakulam": [9.9816, 76.2999],
-    "Gurugram": [28.4595, 77.0266],
-    "Guwahati": [26.1445, 91.7362],
-    "Hyderabad": [17.3850, 78.4867],
-    "Jaipur": [26.9124, 75.7873],
-    "Jorapokhar": [23.7000, 86.4100],
-    "Kochi": [9.9312, 76.2673],
-    "Kolkata": [22.5726, 88.3639],
-    "Lucknow": [26.8467, 80.9462],
-    "Mumbai": [19.0760, 72.8777],
-    "Patna": [25.5941, 85.1376],
-    "Shillong": [25.5788, 91.8933],
-    "Talcher": [20.9500, 85.2167],
-    "Thiruvananthapuram": [8.5241, 76.9366],
-    "Visakhapatnam": [17.6868, 83.2185],
-}
+# ---------------- STATIONS ----------------
+@st.cache_resource(max_entries=4)
+def load_station_index(generation):
+    with connection() as conn:
+        return StationIndex(read_stations(conn.cursor()))
+
+
+def get_stations_version():
+    # Changes whenever stations are added, moved or removed; a cache key for
+    # anything drawn from station coordinates
+    with connection() as conn:
+        return stations_generation(conn.cursor())
+
+
+def get_station_index():
+    # Spatial index over the stations table, rebuilt only when it changes
+    return load_station_index(get_stations_version())
 
 
 def add_coordinates(df):
-    df["Lat"] = df["City"].map({k: v[0] for k, v in CITY_COORDINATES.items()})
-    df["Lon"] = df["City"].map({k: v[1] for k, v in CITY_COORDINATES.items()})
-    return df
+    # Lat/Lon columns from the station registry (NaN for unregistered cities)
+    return get_station_index().join(df)
 
 
 # ---------------- NEWS API ----------------
@@ -200,11 +296,10 @@ def add_coordinates(df):
 def send_daily_report_email():
     # Fetch subscribed users from DB (Fixed: st.session_state is not available in background threads)
     try:
-        conn = sqlite3.connect("aqi.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT username FROM users WHERE subscription=1")
-        users = cursor.fetchall()
-        conn.close()
+        with connection() as conn:
+            users = conn.execute(
+                "SELECT username FROM users WHERE subscription=1"
+            ).fetchall()
 
         for user in users:
             user_email = user[0]
@@ -256,195 +351,456 @@ def get_wind_arrow_icon(angle, speed):
     )
 
 
+# AQI bands of the time-lapse markers: above 50 yellow, above 100 orange, ...
+TIMELAPSE_BREAKS = [50, 100, 200, 300]
+TIMELAPSE_COLORS = ["green", "yellow", "orange", "purple", "red"]
+TIMELAPSE_LABELS = ["0-50", "51-100", "101-200", "201-300", "300+"]
+
+
+def timelapse_features(map_df):
+    # GeoJSON features for TimestampedGeoJson, built column-wise. Instead of
+    # a Point feature (with its own style and popup) per row, there is one
+    # MultiPoint feature per city and whole-number AQI whose "times" list
+    # holds each point's day, so a day costs just a coordinate pair and a
+    # date string. Popups are per feature, so this keeps the exact reading in
+    # them; a city's readings still share a few hundred distinct AQI values.
+    points = pd.DataFrame(
+        {
+            "City": map_df["City"].astype(str).to_numpy(),
+            "AQI": map_df["AQI"].to_numpy(dtype="float64").round(),
+            "Lon": map_df["Lon"].to_numpy(dtype="float64"),
+            "Lat": map_df["Lat"].to_numpy(dtype="float64"),
+            "Time": map_df["Date"].dt.strftime("%Y-%m-%d").to_numpy(),
+        }
+    ).dropna(subset=["AQI"])
+    # One sort, then each feature is a slice between group boundaries: a
+    # groupby loop over thousands of small groups is far slower
+    points = points.sort_values(["City", "AQI", "Time"], ignore_index=True)
+    keys = points[["City", "AQI"]]
+    starts = np.flatnonzero(keys.ne(keys.shift()).any(axis=1)).tolist()
+    cities, values = points["City"].tolist(), points["AQI"].tolist()
+    coordinates = points[["Lon", "Lat"]].to_numpy().tolist()
+    times = points["Time"].tolist()
+
+    features = []
+    for start, end in zip(starts, starts[1:] + [len(points)]):
+        city, aqi = cities[start], values[start]
+        band = np.searchsorted(TIMELAPSE_BREAKS, aqi, side="left")
+        color = TIMELAPSE_COLORS[band]
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "MultiPoint",
+                    "coordinates": coordinates[start:end],
+                },
+                "properties": {
+                    "times": times[start:end],
+                    "aqi": int(aqi),
+                    "style": {"color": color},
+                    "icon": "circle",
+                    "iconstyle": {
+                        "fillColor": color,
+                        "fillOpacity": 0.8,
+                        "stroke": "true",
+                        "radius": 10,
+                    },
+                    "popup": f"{city}: AQI {aqi:.0f} ({TIMELAPSE_LABELS[band]})",
+                },
+            }
+        )
+    return features
+
+
+def map_html(folium_map):
+    # The map's standalone HTML page; st_html puts it in an iframe itself, so
+    # this skips the base64 data-URI iframe _repr_html_() wraps around it
+    return folium_map.get_root().render()
+
+
+# Station maps are drawn for a viewport (what a map of this size shows around
+# a centre at a zoom) instead of for every station, and nearby stations are
+# merged into clusters; marker count then depends on the map size, not on how
+# many stations there are. Sizes are the wide-layout map frames.
+MAP_VIEW_WIDTH_PX = 1100
+MAP_VIEW_HEIGHT_PX = 500
+ALL_STATIONS_VIEW = "All stations"
+
+
+def render_map_view(key, cities):
+    # Centre/zoom/clustering widgets for a map of the given cities. "All
+    # stations" fits the view to all of them that are registered; centring on
+    # one lets the zoom be picked. Returns the view ("key" goes in cache keys,
+    # with the stations version: the fit and clusters follow the coordinates).
+    stations_version = get_stations_version()
+    index = load_station_index(stations_version)
+    lats, lons = index.locate(cities)
+    placed = [city for city, lat in zip(cities, lats) if not np.isnan(lat)]
+    options = [ALL_STATIONS_VIEW] + placed
+    if st.session_state.get(f"{key}_focus") not in options:
+        st.session_state.pop(f"{key}_focus", None)
+
+    col_focus, col_zoom, col_cluster = st.columns([2, 2, 1])
+    focus = col_focus.selectbox("Centre map on", options, key=f"{key}_focus")
+    if focus == ALL_STATIONS_VIEW:
+        if placed:
+            lat, lon, zoom = fit_view(
+                lats[~np.isnan(lats)],
+                lons[~np.isnan(lons)],
+                MAP_VIEW_WIDTH_PX,
+                MAP_VIEW_HEIGHT_PX,
+            )
+        else:
+            lat, lon, zoom = 20.5937, 78.9629, 4
+        col_zoom.caption(f"Zoom {zoom} (fitted to the stations)")
+    else:
+        lat, lon = index.coordinates(focus)
+        zoom = col_zoom.select_slider(
+            "Zoom", list(range(3, MAX_VIEW_ZOOM + 1)), value=8, key=f"{key}_zoom"
+        )
+    cluster = col_cluster.checkbox("Cluster stations", value=True, key=f"{key}_cluster")
+    return {
+        "center": (lat, lon),
+        "zoom": zoom,
+        "bounds": viewport_bounds(
+            lat, lon, zoom, MAP_VIEW_WIDTH_PX, MAP_VIEW_HEIGHT_PX
+        ),
+        "cluster": cluster,
+        "key": (focus, zoom, cluster, stations_version),
+    }
+
+
+def view_frame(df, view):
+    # Rows of df (City, Lat, Lon, AQI, optionally Date) for the stations in
+    # the view. Clustered, City becomes the cluster's label and there is one
+    # row per cluster (and Date) with the stations' mean AQI at their
+    # centroid; Stations counts the stations behind each row.
+    index = get_station_index()
+    in_view = index.stations["City"].iloc[index.in_bbox(*view["bounds"])]
+    df = df[df["City"].isin(in_view)]
+    if not view["cluster"] or df.empty:
+        return df.assign(Stations=1)
+
+    # Labels are built from the names, so drop the Dashboard's categorical
+    # City (it has no order for min() and no string concatenation)
+    df = df.assign(City=df["City"].astype(str))
+    places = df.drop_duplicates("City")[["City", "Lat", "Lon"]]
+    places = places.assign(
+        Cluster=cluster_points(places["Lat"], places["Lon"], view["zoom"])
+    )
+    clusters = places.groupby("Cluster").agg(
+        Lat=("Lat", "mean"),
+        Lon=("Lon", "mean"),
+        Stations=("City", "size"),
+        First=("City", "min"),
+    )
+    clusters["Label"] = clusters["First"].where(
+        clusters["Stations"] == 1,
+        clusters["First"] + " +" + (clusters["Stations"] - 1).astype(str),
+    )
+    keys = ["Cluster"] + (["Date"] if "Date" in df.columns else [])
+    readings = (
+        df[["City", "AQI"] + keys[1:]]
+        .merge(places[["City", "Cluster"]], on="City")
+        .groupby(keys, as_index=False)["AQI"]
+        .mean()
+    )
+    return readings.join(
+        clusters[["Label", "Lat", "Lon", "Stations"]], on="Cluster"
+    ).rename(columns={"Label": "City"})
+
+
+# Interpolated AQI surface: a grid over India (south, west, north, east),
+# filled by inverse-distance weighting of each cell's nearest stations
+SURFACE_BOUNDS = (6.0, 68.0, 37.5, 97.5)
+SURFACE_GRID = (160, 150)  # rows x columns, about 0.2 degrees per cell
+IDW_POWER = 2
+IDW_NEIGHBOURS = 8
+IDW_MAX_DISTANCE = 4.0  # Search radius in degrees; cells with no station in it stay clear
+IDW_TILE_CELLS = 32  # Grid cells per tile side; each tile only sees stations in reach
+# CPCB band colours (same bands as AQI_CATEGORY_BREAKPOINTS), RGBA
+SURFACE_COLORS = np.array(
+    [
+        [0, 176, 80, 170],
+        [146, 208, 80, 170],
+        [255, 255, 0, 170],
+        [255, 153, 0, 170],
+        [255, 0, 0, 170],
+        [192, 0, 0, 170],
+    ],
+    dtype="uint8",
+)
+
+
+def idw_surface(
+    lats,
+    lons,
+    values,
+    bounds=SURFACE_BOUNDS,
+    shape=SURFACE_GRID,
+    power=IDW_POWER,
+    neighbours=IDW_NEIGHBOURS,
+    max_distance=IDW_MAX_DISTANCE,
+):
+    # AQI per grid cell, top row first, from up to `neighbours` nearest
+    # stations within max_distance. Rows are evenly spaced in Web Mercator
+    # rather than latitude, so the image lines up with the tiles when Leaflet
+    # stretches it over the bounds. Distances are planar with longitude scaled
+    # by cos(latitude), which is close enough at this extent. The grid is
+    # worked in tiles: each tile takes the stations within reach of it and
+    # gets all its squared distances from one matrix product, so the cost
+    # follows local station density rather than the size of the network.
+    south, west, north, east = bounds
+    rows, cols = shape
+    lats = np.asarray(lats, dtype="float64")
+    lons = np.asarray(lons, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    keep = ~(np.isnan(lats) | np.isnan(lons) | np.isnan(values))
+    lats, lons, values = lats[keep], lons[keep], values[keep]
+    surface = np.full((rows, cols), np.nan)
+
+    grid_lats = np.degrees(
+        2 * np.arctan(np.exp(np.linspace(mercator_y(north), mercator_y(south), rows)))
+        - np.pi / 2
+    )
+    scale = np.cos(np.radians((south + north) / 2))
+    grid_xs = np.linspace(west, east, cols) * scale
+    xs = lons * scale
+    reach2 = max_distance**2
+
+    for r0 in range(0, rows, IDW_TILE_CELLS):
+        tile_lats = grid_lats[r0 : r0 + IDW_TILE_CELLS]
+        in_band = (lats >= tile_lats[-1] - max_distance) & (
+            lats <= tile_lats[0] + max_distance
+        )
+        for c0 in range(0, cols, IDW_TILE_CELLS):
+            tile_xs = grid_xs[c0 : c0 + IDW_TILE_CELLS]
+            near = np.flatnonzero(
+                in_band
+                & (xs >= tile_xs[0] - max_distance)
+                & (xs <= tile_xs[-1] + max_distance)
+            )
+            if not len(near):
+                continue
+            cells = np.column_stack(
+                [np.tile(tile_xs, len(tile_lats)), np.repeat(tile_lats, len(tile_xs))]
+            )
+            stations = np.column_stack([xs[near], lats[near]])
+            dist2 = (
+                (cells**2).sum(axis=1)[:, None]
+                + (stations**2).sum(axis=1)
+                - 2 * cells @ stations.T
+            )
+            np.maximum(dist2, 0, out=dist2)
+            near_values = values[near]
+            if neighbours < len(near):
+                nearest = np.argpartition(dist2, neighbours - 1, axis=1)[:, :neighbours]
+                dist2 = np.take_along_axis(dist2, nearest, axis=1)
+                near_values = near_values[nearest]
+            # A cell on top of a station takes (practically) that station's
+            # value; stations out of reach get no weight
+            weights = np.where(
+                dist2 <= reach2, np.maximum(dist2, 1e-12) ** (-power / 2), 0.0
+            )
+            total = weights.sum(axis=1)
+            with np.errstate(invalid="ignore"):
+                tile_surface = (weights * near_values).sum(axis=1) / total
+            surface[r0 : r0 + len(tile_lats), c0 : c0 + len(tile_xs)] = (
+                tile_surface.reshape(len(tile_lats), len(tile_xs))
+            )
+    return surface
+
+
+def surface_image(surface):
+    # RGBA raster of an AQI surface in CPCB band colours, clear where NaN
+    codes = np.searchsorted(AQI_CATEGORY_BREAKPOINTS, surface, side="left")
+    image = SURFACE_COLORS[np.minimum(codes, len(SURFACE_COLORS) - 1)]
+    image[np.isnan(surface)] = 0
+    return image
+
+
 # ---------------- USER DATABASE (Signup/Login) ----------------
 def init_user_db():
-    conn = sqlite3.connect("aqi.db")
-    cursor = conn.cursor()
-    cursor.execute(
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT,
+                role TEXT DEFAULT 'user'
+            )
         """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT,
-            role TEXT DEFAULT 'user'
         )
-    """
-    )
 
-    # Migration: Add role column if it doesn't exist (for existing databases)
-    try:
-        cursor.execute("SELECT role FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
-
-    # Create Default Admin if not exists
-    cursor.execute("SELECT * FROM users WHERE role='admin'")
-    if not cursor.fetchone():
-        admin_pw = bcrypt.hashpw("admin123".encode(), bcrypt.gensalt()).decode()
+        # Migration: Add role column if it doesn't exist (for existing databases)
         try:
-            cursor.execute(
-                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                ("admin", admin_pw, "admin"),
-            )
-        except sqlite3.IntegrityError:
-            pass
+            cursor.execute("SELECT role FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
+
+        # Create Default Admin if not exists
+        cursor.execute("SELECT * FROM users WHERE role='admin'")
+        if not cursor.fetchone():
+            admin_pw = bcrypt.hashpw("admin123".encode(), bcrypt.gensalt()).decode()
+            try:
+                cursor.execute(
+                    "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                    ("admin", admin_pw, "admin"),
+                )
+            except sqlite3.IntegrityError:
+                pass
 
-    # Migration: Add profile_pic column if it doesn't exist
-    try:
-        cursor.execute("SELECT profile_pic FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE users ADD COLUMN profile_pic BLOB")
+        # Migration: Add profile_pic column if it doesn't exist
+        try:
+            cursor.execute("SELECT profile_pic FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN profile_pic BLOB")
 
-    # Create Activity Logs Table
-    cursor.execute(
+        # Create Activity Logs Table
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS activity_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                action TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
         """
-        CREATE TABLE IF NOT EXISTS activity_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            action TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    """
-    )
 
-    # Create Feedback Table
-    cursor.execute(
+        # Create Feedback Table
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                city TEXT,
+                issue_type TEXT,
+                description TEXT,
+                status TEXT DEFAULT 'Pending',
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
         """
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            city TEXT,
-            issue_type TEXT,
-            description TEXT,
-            status TEXT DEFAULT 'Pending',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    """
-    )
 
-    # Migration: Add status column to feedback if it doesn't exist
-    try:
-        cursor.execute("SELECT status FROM feedback LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE feedback ADD COLUMN status TEXT DEFAULT 'Pending'")
+        # Migration: Add status column to feedback if it doesn't exist
+        try:
+            cursor.execute("SELECT status FROM feedback LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE feedback ADD COLUMN status TEXT DEFAULT 'Pending'")
 
-    # Migration: Add subscription column to users
-    try:
-        cursor.execute("SELECT subscription FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE users ADD COLUMN subscription INTEGER DEFAULT 0")
+        # Migration: Add subscription column to users
+        try:
+            cursor.execute("SELECT subscription FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN subscription INTEGER DEFAULT 0")
 
-    # Migration: Add favorite_cities column to users
-    try:
-        cursor.execute("SELECT favorite_cities FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE users ADD COLUMN favorite_cities TEXT")
+        # Migration: Add favorite_cities column to users
+        try:
+            cursor.execute("SELECT favorite_cities FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN favorite_cities TEXT")
 
-    # Create Settings Table (For Maintenance Mode)
-    cursor.execute(
+        # Create Settings Table (For Maintenance Mode)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
         """
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
         )
-    """
-    )
-    cursor.execute(
-        "INSERT OR IGNORE INTO settings (key, value) VALUES ('maintenance_mode', 'false')"
-    )
+        seed_setting(cursor, "maintenance_mode", "false")
 
-    conn.commit()
-    conn.close()
+        # Create User Datasets Table (saved uploads, stored as Arrow files)
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_datasets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                rows INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (username, name)
+            )
+        """
+        )
+
+        # Migration: Bring air_quality up to the indexed (City, Date) schema
+        migrate_air_quality_schema(cursor)
+        migrate_stations_schema(cursor)
 
 
 def log_user_activity(username, action):
     try:
-        conn = sqlite3.connect("aqi.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO activity_logs (username, action) VALUES (?, ?)",
-            (username, action),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO activity_logs (username, action) VALUES (?, ?)",
+                (username, action),
+            )
     except:
         pass
 
 
 # ---------------- SETTINGS HELPERS ----------------
 def get_maintenance_mode():
-    conn = sqlite3.connect("aqi.db")
-    c = conn.cursor()
     try:
-        c.execute("SELECT value FROM settings WHERE key='maintenance_mode'")
-        row = c.fetchone()
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM settings WHERE key='maintenance_mode'"
+            ).fetchone()
         return row[0] == "true" if row else False
     except:
         return False
-    finally:
-        conn.close()
 
 
 def set_maintenance_mode(status):
-    conn = sqlite3.connect("aqi.db")
-    c = conn.cursor()
     val = "true" if status else "false"
-    c.execute(
-        "INSERT OR REPLACE INTO settings (key, value) VALUES ('maintenance_mode', ?)",
-        (val,),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES ('maintenance_mode', ?)",
+            (val,),
+        )
 
 
 def get_activity_log_for_feedback(feedback_id):
     try:
-        conn = sqlite3.connect("aqi.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT activity_logs.* FROM activity_logs
-            JOIN feedback ON activity_logs.username = feedback.username
-            WHERE feedback.id = ?
-        """,
-            (feedback_id,),
-        )
-        log = cursor.fetchone()
-        conn.close()
+        with connection() as conn:
+            log = conn.execute(
+                """
+                SELECT activity_logs.* FROM activity_logs
+                JOIN feedback ON activity_logs.username = feedback.username
+                WHERE feedback.id = ?
+            """,
+                (feedback_id,),
+            ).fetchone()
         return log
     except:
         return None
 
 
 def signup_user(username, password):
-    conn = sqlite3.connect("aqi.db")
-    cursor = conn.cursor()
-
     hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-            (username, hashed_pw, "user"),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                (username, hashed_pw, "user"),
+            )
         return True
     except:
-        conn.close()
         return False
 
 
 def login_user(username, password):
-    conn = sqlite3.connect("aqi.db")
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT password, role, favorite_cities FROM users WHERE username=?",
-        (username,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT password, role, favorite_cities FROM users WHERE username=?",
+            (username,),
+        ).fetchone()
 
     if row:
         stored_hash = row[0].encode()
@@ -464,27 +820,24 @@ def login_google_user(token):
         )
         email = id_info["email"]
 
-        conn = sqlite3.connect("aqi.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT username, role, favorite_cities FROM users WHERE username=?",
-            (email,),
-        )
-        row = cursor.fetchone()
-
-        if not row:
-            # Register new Google user with a placeholder password
+        with transaction() as cursor:
             cursor.execute(
-                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                (email, "GOOGLE_AUTH", "user"),
+                "SELECT username, role, favorite_cities FROM users WHERE username=?",
+                (email,),
             )
-            conn.commit()
-            role = "user"
-            favs = []
-        else:
-            role = row[1]
-            favs = row[2].split(",") if row[2] else []
-        conn.close()
+            row = cursor.fetchone()
+
+            if not row:
+                # Register new Google user with a placeholder password
+                cursor.execute(
+                    "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                    (email, "GOOGLE_AUTH", "user"),
+                )
+                role = "user"
+                favs = []
+            else:
+                role = row[1]
+                favs = row[2].split(",") if row[2] else []
         return email, role, favs
     except ValueError:
         return None, None, []
@@ -520,51 +873,1146 @@ def send_reset_email(to_email):
 init_user_db()
 
 
-# ---------------- AQI DATABASE (SQLite) ----------------
-@st.cache_data(ttl=600)  # Cache data for 10 minutes to optimize performance
-def get_data():
-    conn = sqlite3.connect("aqi.db")
-    query = "SELECT City, Date, AQI, PM25, PM10, NO2, SO2, CO, O3 FROM air_quality"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+# ---------------- AQI CATEGORY ----------------
+# Upper bound (inclusive) of each band; anything above the last one is Severe
+AQI_CATEGORY_BREAKPOINTS = np.array([50, 100, 200, 300, 400], dtype="float64")
+AQI_CATEGORIES = ["Good", "Satisfactory", "Moderate", "Poor", "Very Poor", "Severe"]
+
+
+def categorize_aqi(values):
+    # Vectorized over any array-like of AQI values (None/NaN -> "Unknown");
+    # returns a Categorical with a fixed category list so frames concat cleanly
+    values = np.asarray(values, dtype="float64")
+    codes = np.searchsorted(AQI_CATEGORY_BREAKPOINTS, values, side="left")
+    codes[np.isnan(values)] = len(AQI_CATEGORIES)
+    return pd.Categorical.from_codes(codes, categories=AQI_CATEGORIES + ["Unknown"])
+
 
+def aqi_category(aqi):
+    return categorize_aqi([aqi])[0]
+
+
+# ---------------- AQI DATABASE (SQLite) ----------------
+AQI_COLUMNS = "City, Date, AQI, PM25, PM10, NO2, SO2, CO, O3"
+AQI_QUERY = f"SELECT {AQI_COLUMNS} FROM air_quality"
+DATA_REFRESH_SECONDS = 60  # How often the resident frame checks aqi.db for changes
+SNAPSHOT_PATH = "aqi_snapshot.arrow"
+SNAPSHOT_MAX_LAG = 50_000  # Appended rows tolerated before the snapshot is rewritten
+
+
+def prepare_aqi_frame(df):
+    # Shared post-processing for every air_quality loader. Frames stay compact:
+    # categorical City, datetime64 Date and float64 readings with NaN for
+    # missing values (converted to None only for display, see to_display_frame)
+    df["City"] = df["City"].astype("category")
     df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-    df = df.replace({np.nan: None})
+    df[POLLUTANT_COLUMNS] = df[POLLUTANT_COLUMNS].apply(
+        pd.to_numeric, errors="coerce"
+    ).astype("float64")
+    df["AQI_Category"] = categorize_aqi(df["AQI"])
     return df
 
 
+def append_aqi_rows(df, new_rows):
+    # Align City categories first so the concatenated column stays categorical
+    missing = new_rows["City"].cat.categories.difference(df["City"].cat.categories)
+    if len(missing):
+        df = df.assign(City=df["City"].cat.add_categories(missing))
+    new_rows["City"] = new_rows["City"].cat.set_categories(
+        df["City"].cat.categories
+    )
+    return pd.concat([df, new_rows], ignore_index=True)
+
+
+def to_display_frame(df):
+    # Missing readings as None instead of NaN, for text output and tables
+    return df.astype(object).where(df.notna(), None)
+
+
+@st.cache_resource
+def get_data_store():
+    # Process-wide resident frame plus the rowid high-water mark and rewrite
+    # generation it was loaded at. The frame is shared by every session and
+    # never modified in place: refreshes swap in a new frame instead.
+    return {
+        "df": None,
+        "high_water": 0,
+        "snapshot_high_water": None,
+        "generation": None,
+        "version": None,
+        "checked_at": 0.0,
+        "lock": threading.Lock(),
+    }
+
+
+def save_snapshot(df, generation, high_water):
+    # Columnar copy of the resident frame next to aqi.db (Arrow IPC, City and
+    # AQI_Category dictionary-encoded), tagged with the data it reflects.
+    # Written to a temp file first so readers never see a partial snapshot.
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {
+            "generation": str(generation),
+            "high_water": str(high_water),
+            "rows": str(len(df)),
+        }
+    )
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except OSError as e:
+        print(f"Snapshot Error: {e}")
+
+
+def load_snapshot(cursor, generation):
+    # The snapshot as a frame if it still matches aqi.db: same rewrite
+    # generation and the same rows up to its high-water mark. Returns
+    # (frame, high_water), or (None, 0) when it has to be rebuilt from SQLite.
+    # The file is memory-mapped only to read it; to_pandas() copies it onto
+    # the heap like any other load. What the snapshot saves is the SQLite
+    # read and parsing on a cold start, not memory: the resident frame is
+    # the whole table either way.
+    try:
+        table = pa.ipc.open_file(pa.memory_map(SNAPSHOT_PATH, "r")).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None, 0
+
+    meta = table.schema.metadata or {}
+    if meta.get(b"generation", b"").decode() != str(generation):
+        return None, 0
+    high_water = int(meta[b"high_water"])
+    cursor.execute("SELECT COUNT(*) FROM air_quality WHERE id <= ?", (high_water,))
+    if cursor.fetchone()[0] != int(meta[b"rows"]):
+        return None, 0
+
+    return table.to_pandas(), high_water
+
+
+def refresh_data_store(store):
+    with connection() as conn:
+        c = conn.cursor()
+        # Keep the rollup tables in step with the rows about to be loaded
+        with conn:
+            sync_rollups(c)
+
+        # Read the generation before the rows: a rewrite racing with this load
+        # leaves a stale generation behind and forces a full reload next time
+        c.execute("SELECT value FROM settings WHERE key='air_quality_generation'")
+        row = c.fetchone()
+        generation = row[0] if row else None
+
+        if store["df"] is None or generation != store["generation"]:
+            # Cold start or rewrite: start from the snapshot when it is fresh
+            df, high_water = load_snapshot(c, generation)
+            snapshot_high_water = high_water if df is not None else None
+        else:
+            df, high_water = store["df"], store["high_water"]
+            snapshot_high_water = store["snapshot_high_water"]
+
+        new_rows = pd.read_sql_query(
+            f"SELECT id, {AQI_COLUMNS} FROM air_quality WHERE id > ? ORDER BY id",
+            conn,
+            params=[high_water],
+        )
+
+    if not new_rows.empty:
+        high_water = int(new_rows["id"].max())
+    new_rows = prepare_aqi_frame(new_rows.drop(columns="id"))
+
+    if df is None:
+        df = new_rows
+    elif not new_rows.empty:
+        df = append_aqi_rows(df, new_rows)
+
+    # Rewrite the snapshot after a rebuild from SQLite, or once enough rows
+    # were appended that replaying them on the next cold start gets slow
+    if (
+        snapshot_high_water is None
+        or high_water - snapshot_high_water > SNAPSHOT_MAX_LAG
+    ):
+        save_snapshot(df, generation, high_water)
+        snapshot_high_water = high_water
+
+    store["df"] = df
+    store["high_water"] = high_water
+    store["snapshot_high_water"] = snapshot_high_water
+    store["generation"] = generation
+    store["version"] = f"{generation}:{high_water}"
+    store["checked_at"] = time.time()
+
+
+def get_data():
+    # Only rows appended since the last check are read; updates or deletes
+    # (detected via the generation counter) trigger a full reload.
+    # Returns the shared frame itself, not a per-session copy: treat it as
+    # read-only and derive new frames (filters, .copy()) before modifying.
+    store = get_data_store()
+    with store["lock"]:
+        if (
+            store["df"] is None
+            or time.time() - store["checked_at"] >= DATA_REFRESH_SECONDS
+        ):
+            refresh_data_store(store)
+        return store["df"]
+
+
+def get_data_version():
+    # Changes whenever rows are appended, updated or deleted; used as a cache key
+    return get_data_store()["version"]
+
+
+@st.cache_data
+def get_city_list(data_version):
+    with connection() as conn:
+        rows = conn.execute("SELECT DISTINCT City FROM air_quality ORDER BY City")
+        cities = [row[0] for row in rows.fetchall()]
+    return cities
+
+
+@st.cache_data
+def get_date_bounds(data_version):
+    with connection() as conn:
+        min_date, max_date = conn.execute(
+            "SELECT MIN(Date), MAX(Date) FROM air_quality"
+        ).fetchone()
+    return pd.to_datetime(min_date), pd.to_datetime(max_date)
+
+
+@st.cache_data(max_entries=64)
+def get_filtered_data(cities, start_date=None, end_date=None, data_version=None):
+    # Only the rows for the selected cities/date range are read from aqi.db;
+    # each (cities, start_date, end_date, data_version) combination is cached.
+    placeholders = ", ".join("?" for _ in cities)
+    query = f"{AQI_QUERY} WHERE City IN ({placeholders})"
+    params = list(cities)
+
+    if start_date and end_date:
+        query += " AND Date BETWEEN ? AND ?"
+        params.extend([start_date, end_date])
+
+    with connection() as conn:
+        df = pd.read_sql_query(query + " ORDER BY City, Date", conn, params=params)
+
+    return prepare_aqi_frame(df)
+
+
+def date_range_bounds(date_range):
+    # ISO (start, end) strings for a complete sidebar date range, else (None, None)
+    if len(date_range) == 2:
+        start_date, end_date = date_range
+        return start_date.isoformat(), end_date.isoformat()
+    return None, None
+
+
+@st.cache_data(max_entries=64)
+def get_rollup_stats(cities=None, start_date=None, end_date=None, data_version=None):
+    # Per-city count/sum/mean/var/min/max of every reading, read from the
+    # rollups instead of the raw rows. Whole months inside the range come from
+    # the monthly buckets, the partial months at either end from the raw days.
+    # Columns are (stat, pollutant), e.g. stats["mean"][["PM25", "NO2"]].
+    if start_date and end_date:
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        first_month = start if start.day == 1 else start + pd.offsets.MonthBegin()
+        last_month = (end + pd.Timedelta(days=1)).to_period("M").to_timestamp()
+        if first_month >= last_month:
+            first_month = last_month = start
+        edges = [d.strftime("%Y-%m-%d") for d in (first_month, last_month)]
+        month_clause = "Bucket >= ? AND Bucket < ?"
+        day_clause = "((Date >= ? AND Date < ?) OR (Date >= ? AND Date <= ?))"
+        month_params = list(edges)
+        day_params = [start_date, edges[0], edges[1], end_date]
+    else:
+        month_clause = day_clause = "1"
+        month_params = []
+        day_params = None
+
+    if cities is not None:
+        placeholders = ", ".join("?" for _ in cities)
+        month_clause += f" AND City IN ({placeholders})"
+        day_clause += f" AND City IN ({placeholders})"
+        month_params.extend(cities)
+        if day_params is not None:
+            day_params.extend(cities)
+
+    rollup_columns = ", ".join(ROLLUP_COLUMNS)
+    query = f"""
+        SELECT City, {rollup_columns} FROM air_quality_rollup
+        WHERE Grain = 'month' AND {month_clause}
+    """
+    params = month_params
+    if day_params is not None:
+        query += f"""
+        UNION ALL
+        SELECT City, {ROLLUP_PROJECTION} FROM air_quality WHERE {day_clause}
+    """
+        params = month_params + day_params
+
+    totals = ", ".join(
+        f"SUM({p}_n) AS {p}_n, SUM({p}_sum) AS {p}_sum, "
+        f"SUM({p}_sumsq) AS {p}_sumsq, MIN({p}_min) AS {p}_min, "
+        f"MAX({p}_max) AS {p}_max"
+        for p in POLLUTANT_COLUMNS
+    )
+    with connection() as conn:
+        raw = pd.read_sql_query(
+            f"SELECT City, {totals} FROM ({query}) GROUP BY City ORDER BY City",
+            conn,
+            params=params,
+            index_col="City",
+        )
+
+    def stat(name):
+        cols = [f"{p}_{name}" for p in POLLUTANT_COLUMNS]
+        return raw[cols].astype("float64").set_axis(POLLUTANT_COLUMNS, axis=1)
+
+    count, total, sumsq = stat("n"), stat("sum"), stat("sumsq")
+    mean = total / count
+    var = ((sumsq - total * mean) / (count - 1)).where(count > 1)
+    return pd.concat(
+        {
+            "count": count,
+            "sum": total,
+            "mean": mean,
+            "var": var.clip(lower=0),
+            "min": stat("min"),
+            "max": stat("max"),
+        },
+        axis=1,
+    )
+
+
+RAW_PAGE_SIZES = [50, 100, 500]
+RAW_SORT_COLUMNS = ["Date", "City"] + POLLUTANT_COLUMNS
+
+
+def raw_data_filter(cities, start_date, end_date, search):
+    # WHERE clause (and params) for the Raw Data viewer: the sidebar filters
+    # plus a case-insensitive substring search on City or Date
+    clause = f"City IN ({', '.join('?' for _ in cities)})"
+    params = list(cities)
+    if start_date and end_date:
+        clause += " AND Date BETWEEN ? AND ?"
+        params.extend([start_date, end_date])
+    if search:
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", search) + "%"
+        clause += " AND (City LIKE ? ESCAPE '\\' OR Date LIKE ? ESCAPE '\\')"
+        params.extend([pattern, pattern])
+    return clause, params
+
+
+def raw_sort_key(column, descending):
+    # Missing readings sort last in either direction; with id as tie-breaker
+    # (key, id) is unique, which keyset pagination needs
+    if column in ("City", "Date"):
+        return column
+    return f"IFNULL({column}, {'-9e999' if descending else '9e999'})"
+
+
+@st.cache_data(max_entries=64)
+def count_raw_rows(cities, start_date, end_date, search, data_version=None):
+    clause, params = raw_data_filter(cities, start_date, end_date, search)
+    with connection() as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM air_quality WHERE {clause}", params
+        ).fetchone()[0]
+
+
+@st.cache_data(max_entries=256)
+def get_raw_page(
+    cities,
+    start_date,
+    end_date,
+    search,
+    sort_column,
+    descending,
+    after,
+    page_size,
+    data_version=None,
+):
+    # One page of rows, sorted in SQLite. after is the (sort key, id) of the
+    # previous page's last row, so each page is a range scan past that key
+    # instead of an OFFSET that re-reads every earlier page. Fetches one row
+    # more than page_size to tell whether a next page exists.
+    key = raw_sort_key(sort_column, descending)
+    direction = "DESC" if descending else "ASC"
+    clause, params = raw_data_filter(cities, start_date, end_date, search)
+    if after is not None:
+        clause += f" AND ({key}, id) {'<' if descending else '>'} (?, ?)"
+        params.extend(after)
+    query = f"""
+        SELECT id, {AQI_COLUMNS}, {key} AS sort_key FROM air_quality
+        WHERE {clause}
+        ORDER BY {key} {direction}, id {direction}
+        LIMIT ?
+    """
+    with connection() as conn:
+        return pd.read_sql_query(query, conn, params=params + [page_size + 1])
+
+
 df = get_data()
 
 
-# ---------------- AQI CATEGORY ----------------
-def aqi_category(aqi):
-    if aqi is None:
-        return "Unknown"
-    if aqi <= 50:
-        return "Good"
-    elif aqi <= 100:
-        return "Satisfactory"
-    elif aqi <= 200:
-        return "Moderate"
-    elif aqi <= 300:
-        return "Poor"
-    elif aqi <= 400:
-        return "Very Poor"
+# ---------------- USER DATASETS ----------------
+# Uploads a user saves by name, kept per account as Arrow IPC files with the
+# same compact dtypes as get_data(), and usable as the Dashboard data source
+DATASETS_DIR = "user_datasets"
+DATABASE_SOURCE = "AQI Database"
+
+
+def user_dataset_path(username, name):
+    # Hashed, so neither usernames nor dataset names ever become raw paths
+    user_dir = hashlib.sha256(username.encode()).hexdigest()[:16]
+    file_name = hashlib.sha256(name.encode()).hexdigest()[:16]
+    return os.path.join(DATASETS_DIR, user_dir, f"{file_name}.arrow")
+
+
+def save_user_dataset(username, name, upload_df):
+    # Normalize an upload like an ingest (one row per City/Date with sub-daily
+    # readings averaged, negative readings dropped, AQI computed if missing)
+    # and store it columnar. Returns (rows, rejected, duplicates, aggregated);
+    # raises ValueError for uploads without City/Date/pollutant columns.
+    clean, rejected, duplicates, aggregated = normalize_air_quality(upload_df)
+    if clean.empty:
+        raise ValueError("No rows with both a City and a Date to save")
+    frame = prepare_aqi_frame(
+        clean.reindex(columns=["City", "Date"] + POLLUTANT_COLUMNS)
+    ).sort_values(["City", "Date"], ignore_index=True)
+
+    path = user_dataset_path(username, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO user_datasets (username, name, path, rows) VALUES (?, ?, ?, ?)
+            ON CONFLICT (username, name) DO UPDATE SET
+                path = excluded.path, rows = excluded.rows,
+                created_at = CURRENT_TIMESTAMP
+        """,
+            (username, name, path, len(frame)),
+        )
+    return len(frame), rejected, duplicates, aggregated
+
+
+def list_user_datasets(username):
+    # {name: path} of the account's saved datasets
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT name, path FROM user_datasets WHERE username=? ORDER BY name",
+            (username,),
+        ).fetchall()
+    return dict(rows)
+
+
+def delete_user_dataset(username, name):
+    with transaction() as cursor:
+        cursor.execute(
+            "DELETE FROM user_datasets WHERE username=? AND name=?", (username, name)
+        )
+    try:
+        os.remove(user_dataset_path(username, name))
+    except OSError as e:
+        print(f"Dataset Delete Error: {e}")
+
+
+@st.cache_resource(max_entries=16)
+def open_user_dataset(path, modified):
+    # A saved dataset as a frame, read when first selected rather than at
+    # login. The Arrow file is memory-mapped only to read it: to_pandas()
+    # copies the table onto the heap, which the Dashboard needs anyway (its
+    # Overview, anomaly and calendar sections use the full history). The
+    # saving is skipping the CSV parse and normalization. modified (the
+    # file's mtime) is part of the cache key, so a dataset saved again under
+    # the same name is reopened. Shared between sessions and never modified
+    # in place.
+    try:
+        with pa.memory_map(path, "r") as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    except (OSError, pa.ArrowInvalid) as e:
+        print(f"Dataset Load Error: {e}")
+        return None
+
+
+def filter_frame(frame, cities, start_date=None, end_date=None):
+    # get_filtered_data() for a frame that is not in aqi.db
+    mask = frame["City"].isin(cities)
+    if start_date and end_date:
+        mask &= frame["Date"].between(start_date, end_date)
+    return frame[mask].sort_values(["City", "Date"], ignore_index=True)
+
+
+def summarize_frame(frame):
+    # get_rollup_stats() for a frame that is not in aqi.db (same layout)
+    grouped = frame.groupby("City", observed=True)[POLLUTANT_COLUMNS]
+    return pd.concat(
+        {
+            "count": grouped.count().astype("float64"),
+            "sum": grouped.sum(min_count=1),
+            "mean": grouped.mean(),
+            "var": grouped.var(),
+            "min": grouped.min(),
+            "max": grouped.max(),
+        },
+        axis=1,
+    )
+
+
+# ---------------- UPLOAD STREAMING ----------------
+UPLOAD_STREAM_BYTES = 50 * 1024 * 1024  # Larger CSV uploads are read in chunks
+UPLOAD_PREVIEW_ROWS = 1000
+UPLOAD_SAMPLE_SIZE = 100_000  # Values kept for the describe() percentiles
+TREND_MAX_POINTS = 5000  # Hourly trend means are coarsened to daily beyond this
+
+
+def read_upload_preview(uploaded_file):
+    # First rows of a CSV upload, for the preview and column selection
+    uploaded_file.seek(0)
+    preview = pd.read_csv(uploaded_file, nrows=UPLOAD_PREVIEW_ROWS)
+    uploaded_file.seek(0)
+    return preview
+
+
+def parse_upload(uploaded_file):
+    # Whole CSV/XLSX upload as a frame, plus whether its AQI column had to be
+    # computed: raw pollutant readings without one are scored with CPCB
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith(".csv"):
+        user_df = pd.read_csv(uploaded_file)
     else:
-        return "Severe"
+        user_df = pd.read_excel(uploaded_file)
+
+    cpcb_cols = [c for c in CPCB_BREAKPOINTS if c in user_df.columns]
+    if "AQI" in user_df.columns or len(cpcb_cols) < 3:
+        return user_df, False
+
+    averaged = apply_cpcb_averaging(user_df) if "Date" in user_df.columns else user_df
+    cpcb = compute_aqi(averaged)
+    user_df["AQI"] = cpcb["AQI"]
+    user_df["Dominant_Pollutant"] = cpcb["Dominant_Pollutant"]
+    return user_df, True
+
+
+def stream_upload_summary(uploaded_file, date_col, val_col, progress=None):
+    # One pass over a CSV upload, CHUNK_ROWS rows and two columns at a time.
+    # The value column is read as text and coerced per chunk: a placeholder
+    # such as "-" deep in the file only becomes NaN, as in a whole-file read.
+    # Keeps a running count/mean/M2 (Chan's parallel variance), min/max, a
+    # uniform random sample for the percentiles and hourly sum/count for the
+    # trend, so memory is bounded by the chunk size, the sample and the number
+    # of hours covered rather than by the file size. Returns describe()-style
+    # statistics and the trend of mean values per hour (or per day).
+    count, mean, m2 = 0, 0.0, 0.0
+    low, high = np.inf, -np.inf
+    sample = np.empty(0)
+    sample_keys = np.empty(0)
+    hourly = None
+    rng = np.random.default_rng()
+
+    uploaded_file.seek(0)
+    chunks = pd.read_csv(
+        uploaded_file,
+        usecols=[date_col, val_col],
+        dtype={date_col: "str", val_col: "str"},
+        chunksize=CHUNK_ROWS,
+    )
+    for chunk in chunks:
+        values = pd.to_numeric(chunk[val_col], errors="coerce")
+        dates = pd.to_datetime(chunk[date_col], errors="coerce")
+        valid = values.notna() & dates.notna()
+        values, dates = values[valid], dates[valid]
+
+        if len(values):
+            chunk_mean = values.mean()
+            chunk_m2 = ((values - chunk_mean) ** 2).sum()
+            delta = chunk_mean - mean
+            total = count + len(values)
+            mean += delta * len(values) / total
+            m2 += chunk_m2 + delta**2 * count * len(values) / total
+            count = total
+            low, high = min(low, values.min()), max(high, values.max())
+
+            # Bottom-k random keys: the values with the smallest keys seen so
+            # far are a uniform sample without replacement
+            keys = np.concatenate([sample_keys, rng.random(len(values))])
+            pool = np.concatenate([sample, values.to_numpy()])
+            keep = slice(None)
+            if len(keys) > UPLOAD_SAMPLE_SIZE:
+                keep = np.argpartition(keys, UPLOAD_SAMPLE_SIZE)[:UPLOAD_SAMPLE_SIZE]
+            sample, sample_keys = pool[keep], keys[keep]
+
+            sums = values.groupby(dates.dt.floor("h")).agg(["sum", "count"])
+            hourly = sums if hourly is None else hourly.add(sums, fill_value=0)
+
+        if progress:
+            progress(min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0))
+
+    if count:
+        q25, q50, q75 = np.percentile(sample, [25, 50, 75])
+        std = np.sqrt(m2 / (count - 1)) if count > 1 else np.nan
+    else:
+        q25 = q50 = q75 = std = mean = low = high = np.nan
+    stats = pd.Series(
+        [count, mean, std, low, q25, q50, q75, high],
+        index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+        name=val_col,
+    )
 
+    if hourly is None:
+        trend = pd.Series(dtype="float64", name=val_col)
+    else:
+        hourly = hourly.sort_index()
+        if len(hourly) > TREND_MAX_POINTS:
+            hourly = hourly.groupby(hourly.index.floor("D")).sum()
+        trend = (hourly["sum"] / hourly["count"]).rename(val_col)
+    trend.index.name = date_col
+    return stats, trend
+
+
+# ---------------- SHARED CACHES ----------------
+# Process-wide least-recently-used caches bounded by size in bytes, as
+# {"entries": OrderedDict of key -> (value, size), "bytes": total, "lock": Lock}
+def lru_cache_store():
+    return {"entries": OrderedDict(), "bytes": 0, "lock": threading.Lock()}
+
+
+def lru_lookup(cache, key):
+    # (True, value) on a hit, which also marks the entry most recently used
+    with cache["lock"]:
+        if key in cache["entries"]:
+            cache["entries"].move_to_end(key)
+            return True, cache["entries"][key][0]
+    return False, None
+
+
+def lru_store(cache, key, value, size, limit):
+    # Values are built outside the lock, so another session may have stored
+    # the same key meanwhile; the first one wins
+    with cache["lock"]:
+        if size <= limit and key not in cache["entries"]:
+            cache["entries"][key] = (value, size)
+            cache["bytes"] += size
+            while cache["bytes"] > limit:
+                _, (_, evicted) = cache["entries"].popitem(last=False)
+                cache["bytes"] -= evicted
+
+
+# ---------------- UPLOAD CACHE ----------------
+UPLOAD_CACHE_BYTES = 512 * 1024 * 1024  # Parsed uploads kept across reruns
+
+
+@st.cache_resource
+def get_upload_cache():
+    # Parsed uploads shared by every session, keyed by (content hash, what was
+    # parsed) and kept in least-recently-used order within UPLOAD_CACHE_BYTES.
+    # Cached frames are shared: derive new frames instead of modifying them.
+    return lru_cache_store()
+
+
+def upload_digest(uploaded_file):
+    # Content hash of an upload, computed once per upload and session
+    digests = st.session_state.setdefault("upload_digests", {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = hashlib.blake2b(
+            uploaded_file.getbuffer(), digest_size=16
+        ).hexdigest()
+    return digests[uploaded_file.file_id]
+
+
+def upload_cache_nbytes(value):
+    if isinstance(value, tuple):
+        return sum(upload_cache_nbytes(item) for item in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return 0
+
+
+def get_cached_upload(uploaded_file, key, parse):
+    # parse() of this upload's content, reused across reruns and by anyone
+    # uploading the same file. Parsing happens outside the lock so other
+    # sessions keep hitting the cache meanwhile.
+    cache = get_upload_cache()
+    entry_key = (upload_digest(uploaded_file), key)
+    hit, value = lru_lookup(cache, entry_key)
+    if not hit:
+        value = parse()
+        size = upload_cache_nbytes(value)
+        lru_store(cache, entry_key, value, size, UPLOAD_CACHE_BYTES)
+    return value
+
+
+# ---------------- EXPORTS ----------------
+EXPORT_CACHE_BYTES = 256 * 1024 * 1024  # Generated download files kept across reruns
+EXCEL_CONSTANT_MEMORY_ROWS = 50_000  # Larger Excel exports are streamed row by row
+EXCEL_CHUNK_ROWS = 10_000  # Rows converted for xlsxwriter at a time
+
+
+@st.cache_resource
+def get_export_cache():
+    # Generated download files shared by every session, keyed by (export
+    # type, filter signature, ...) and kept in least-recently-used order
+    # within EXPORT_CACHE_BYTES. The signature carries the data version, so
+    # new data never serves a stale file.
+    return lru_cache_store()
+
+
+def cached_export(key, build):
+    # Zero-argument callable for st.download_button(data=...): build() only
+    # runs when the button is clicked, and its bytes are reused for the next
+    # click with the same key. The cache is looked up here, in the script
+    # run, because the callable runs outside of it.
+    cache = get_export_cache()
+
+    def export():
+        hit, data = lru_lookup(cache, key)
+        if not hit:
+            data = build()
+            lru_store(cache, key, data, len(data), EXPORT_CACHE_BYTES)
+        return data
+
+    return export
+
+
+def csv_export(df, **kwargs):
+    return df.to_csv(**kwargs).encode("utf-8")
+
+
+def excel_export(df, sheet_name="AQI Data"):
+    # XLSX bytes of df, written with xlsxwriter directly: pandas' to_excel
+    # writes column by column, which constant_memory mode can't take. In that
+    # mode each row is flushed to disk as soon as it is written, so large
+    # selections don't hold the whole sheet in memory.
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(
+        buffer,
+        {
+            "constant_memory": len(df) > EXCEL_CONSTANT_MEMORY_ROWS,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        },
+    )
+    sheet = workbook.add_worksheet(sheet_name)
+    header = workbook.add_format({"bold": True})
+    sheet.write_row(0, 0, [str(col) for col in df.columns], header)
+    for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+        chunk = to_display_frame(df.iloc[start : start + EXCEL_CHUNK_ROWS])
+        for row, values in enumerate(
+            chunk.itertuples(index=False, name=None), start=start + 1
+        ):
+            sheet.write_row(row, 0, values)
+    workbook.close()
+    return buffer.getvalue()
+
+
+def html_export(fig):
+    return fig.to_html().encode("utf-8")
+
+
+def parquet_export(df):
+    # Typed columns straight from the frame (City/AQI_Category stay
+    # dictionary-encoded, Date a timestamp), zstd-compressed
+    sink = pa.BufferOutputStream()
+    pq.write_table(
+        pa.Table.from_pandas(df, preserve_index=False), sink, compression="zstd"
+    )
+    return sink.getvalue().to_pybytes()
 
-df["AQI_Category"] = df["AQI"].apply(aqi_category)
+
+def arrow_export(df):
+    # Arrow IPC file (Feather v2) with zstd-compressed buffers
+    sink = pa.BufferOutputStream()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def render_columnar_downloads(df, filter_signature, file_stem):
+    # Parquet/Arrow downloads of a filtered frame, for reloading in pandas,
+    # polars, R or DuckDB without parsing text
+    col_parquet, col_arrow = st.columns(2)
+    with col_parquet:
+        st.download_button(
+            label="Download Filtered Data (Parquet)",
+            data=cached_export(
+                ("parquet", filter_signature), lambda: parquet_export(df)
+            ),
+            file_name=f"{file_stem}.parquet",
+            mime="application/vnd.apache.parquet",
+        )
+    with col_arrow:
+        st.download_button(
+            label="Download Filtered Data (Arrow)",
+            data=cached_export(("arrow", filter_signature), lambda: arrow_export(df)),
+            file_name=f"{file_stem}.arrow",
+            mime="application/vnd.apache.arrow.file",
+        )
+
+
+# ---------------- FIGURE CACHE ----------------
+FIGURE_CACHE_BYTES = 128 * 1024 * 1024  # Serialized Plotly figures kept across reruns
+
+
+@st.cache_resource
+def get_figure_cache():
+    # Plotly figures as JSON and rendered map HTML, shared by every session.
+    # Keys carry everything a chart depends on (section, chart, filter
+    # signature with the data version, theme and any chart options), so
+    # entries never go stale.
+    return lru_cache_store()
+
+
+def cached_figure(key, build):
+    # build()'s figure, or the cached one for key: on a hit neither the data
+    # preparation nor the figure construction in build() runs again
+    cache = get_figure_cache()
+    hit, figure_json = lru_lookup(cache, key)
+    if hit:
+        return pio.from_json(figure_json)
+    fig = build()
+    figure_json = pio.to_json(fig, validate=False)
+    lru_store(cache, key, figure_json, len(figure_json), FIGURE_CACHE_BYTES)
+    return fig
+
+
+def cached_html(key, build):
+    # Like cached_figure, for rendered HTML (e.g. Folium maps)
+    cache = get_figure_cache()
+    hit, page = lru_lookup(cache, key)
+    if not hit:
+        page = build()
+        lru_store(cache, key, page, len(page), FIGURE_CACHE_BYTES)
+    return page
+
+
+def cached_frame(key, build):
+    # Like cached_figure, for an analysis result that several charts and
+    # downloads share (anomaly flags, calendar layout). The frame itself is
+    # shared between sessions, so callers must not modify it in place.
+    cache = get_figure_cache()
+    hit, frame = lru_lookup(cache, key)
+    if not hit:
+        frame = build()
+        size = int(frame.memory_usage(deep=True).sum())
+        lru_store(cache, key, frame, size, FIGURE_CACHE_BYTES)
+    return frame
+
+
+# ---------------- CHART DOWNSAMPLING ----------------
+# A wide-layout chart is about 1000-1400 px across: more points per line than
+# that only adds markers nobody can tell apart
+LINE_POINTS_PER_SERIES = 1000
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: positions of n_out points of the series
+    # (x ascending) that keep its visual shape. The first and last points are
+    # kept; from each bucket in between, the point forming the largest
+    # triangle with the previous pick and the next bucket's mean, so spikes
+    # and dips survive where plain averaging or striding would flatten them.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    starts = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Mean of each bucket's successor (the last bucket's is the last point)
+    next_x = np.append(np.add.reduceat(x[1:-1], starts[:-1] - 1), 0)[1:]
+    next_y = np.append(np.add.reduceat(y[1:-1], starts[:-1] - 1), 0)[1:]
+    sizes = np.diff(starts)
+    next_x[:-1] /= sizes[1:]
+    next_y[:-1] /= sizes[1:]
+    next_x[-1], next_y[-1] = x[-1], y[-1]
+    # Buckets padded to equal width by repeating their first point (argmax
+    # returns the first of equal maxima, so padding is never picked). The
+    # triangle area with the previous pick (px, py) expands to
+    # |px * A + py * B + C|, so only the pick itself is sequential.
+    width = sizes.max()
+    slots = starts[:-1, None] + np.arange(width)
+    slots = np.where(slots < starts[1:, None], slots, starts[:-1, None])
+    bx, by = x[slots], y[slots]
+    a_term = by - next_y[:, None]
+    b_term = next_x[:, None] - bx
+    c_term = bx * next_y[:, None] - next_x[:, None] * by
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    px, py = x[0], y[0]
+    for i in range(n_out - 2):
+        j = np.abs(px * a_term[i] + py * b_term[i] + c_term[i]).argmax()
+        keep[i + 1] = slots[i, j]
+        px, py = bx[i, j], by[i, j]
+    return keep
+
+
+def downsample_lines(df, x, y, color, points=LINE_POINTS_PER_SERIES):
+    # Rows of df to plot as px.line(df, x, y, color): every line longer than
+    # points is reduced with LTTB (missing y values dropped), shorter lines
+    # are kept whole, so narrowing the date range brings back full resolution.
+    parts = []
+    for _, line in df.groupby(color, observed=True, sort=False):
+        line = line.sort_values(x)
+        if len(line) > points:
+            line = line[line[y].notna()]
+            keep = lttb_indices(
+                line[x].to_numpy().astype("datetime64[s]").astype("float64"),
+                line[y].to_numpy(dtype="float64"),
+                points,
+            )
+            line = line.iloc[keep]
+        parts.append(line)
+    if not parts:
+        return df
+    return pd.concat(parts)
+
+
+# Animated maps show at most this many frames: daily, else weekly, else monthly
+ANIMATION_MAX_FRAMES = 120
+ANIMATION_FRAME_FORMATS = {"Day": "%Y-%m-%d", "Week": "Week of %Y-%m-%d", "Month": "%b %Y"}
+
+
+def period_starts(dates, grain):
+    # First day of each date's day/week (Monday)/month, as datetime64[D]
+    days = dates.to_numpy().astype("datetime64[D]")
+    if grain == "Day":
+        return days
+    if grain == "Week":
+        # 1970-01-01 was a Thursday
+        return days - (days.astype("int64") + 3) % 7
+    return days.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def animation_grain(dates, max_frames=ANIMATION_MAX_FRAMES):
+    # Finest of day/week/month giving at most max_frames frames
+    for grain in ("Day", "Week"):
+        if len(np.unique(period_starts(dates, grain))) <= max_frames:
+            return grain
+    return "Month"
+
+
+def animation_frames(map_df, grain):
+    # One row per period and city (mean AQI), in a single groupby; Frame is
+    # the period's label for animation_frame
+    frames = (
+        map_df.assign(Period=period_starts(map_df["Date"], grain))
+        .groupby(["Period", "City"], observed=True)
+        .agg(AQI=("AQI", "mean"), Lat=("Lat", "first"), Lon=("Lon", "first"))
+        .reset_index()
+    )
+    frames["Frame"] = frames["Period"].dt.strftime(ANIMATION_FRAME_FORMATS[grain])
+    return frames
+
+
+# Above this many rows the deep-dive charts are drawn from aggregates (2-D bin
+# counts, box statistics, histogram counts), so their size stops growing
+DEEP_DIVE_RAW_ROWS = 20_000
+DENSITY_BINS = 80
+HISTOGRAM_BINS = 60
+
+
+def binned_density(df, x, y, bins=DENSITY_BINS):
+    # 2-D histogram of (x, y) as (counts, x centers, y centers); empty cells
+    # are NaN so they render transparent
+    pairs = df[[x, y]].dropna().to_numpy(dtype="float64")
+    counts, x_edges, y_edges = np.histogram2d(pairs[:, 0], pairs[:, 1], bins=bins)
+    counts[counts == 0] = np.nan
+    return (
+        counts.T,
+        (x_edges[:-1] + x_edges[1:]) / 2,
+        (y_edges[:-1] + y_edges[1:]) / 2,
+    )
+
+
+def box_stats(df, by, y):
+    # What a box plot draws, per group: quartiles, and whiskers at the most
+    # extreme values within 1.5 IQR of the box (Tukey), as Plotly does
+    values = df[[by, y]].dropna()
+    grouped = values.groupby(by, observed=True)[y]
+    stats = (
+        grouped.quantile([0.25, 0.5, 0.75])
+        .unstack()
+        .reindex(columns=[0.25, 0.5, 0.75])
+        .set_axis(["q1", "median", "q3"], axis=1)
+    )
+    iqr = stats["q3"] - stats["q1"]
+    low = values[by].map(stats["q1"] - 1.5 * iqr).astype("float64")
+    high = values[by].map(stats["q3"] + 1.5 * iqr).astype("float64")
+    inside = values[y].where(values[y].between(low, high))
+    stats["lowerfence"] = inside.groupby(values[by], observed=True).min()
+    stats["upperfence"] = inside.groupby(values[by], observed=True).max()
+    return stats
+
+
+def histogram_counts(df, x, by, bins=HISTOGRAM_BINS):
+    # Counts per group over bins shared by every group, as a long frame
+    # (by, x bin center, Count) for px.bar
+    values = df[[by, x]].dropna()
+    edges = np.histogram_bin_edges(values[x].to_numpy(dtype="float64"), bins=bins)
+    parts = []
+    for group, group_values in values.groupby(by, observed=True)[x]:
+        counts, _ = np.histogram(group_values.to_numpy(dtype="float64"), bins=edges)
+        parts.append(
+            pd.DataFrame(
+                {by: group, x: (edges[:-1] + edges[1:]) / 2, "Count": counts}
+            )
+        )
+    if not parts:
+        return pd.DataFrame(columns=[by, x, "Count"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def density_figure(df, x, y, title, template):
+    counts, x_centers, y_centers = binned_density(df, x, y)
+    fig = go.Figure(
+        go.Heatmap(
+            z=counts,
+            x=x_centers,
+            y=y_centers,
+            colorscale="Viridis",
+            colorbar=dict(title="Readings"),
+            hovertemplate=f"{x} %{{x:.1f}}<br>{y} %{{y:.0f}}<br>%{{z}} readings<extra></extra>",
+        )
+    )
+    fig.update_layout(title=title, xaxis_title=x, yaxis_title=y, template=template)
+    return fig
+
+
+def box_stats_figure(df, by, y, title, template):
+    fig = go.Figure(
+        [
+            go.Box(
+                name=str(row.Index),
+                q1=[row.q1],
+                median=[row.median],
+                q3=[row.q3],
+                lowerfence=[row.lowerfence],
+                upperfence=[row.upperfence],
+            )
+            for row in box_stats(df, by, y).itertuples()
+        ]
+    )
+    fig.update_layout(title=title, xaxis_title=by, yaxis_title=y, template=template)
+    return fig
+
+
+def histogram_figure(df, x, by, title, template):
+    fig = px.bar(
+        histogram_counts(df, x, by),
+        x=x,
+        y="Count",
+        color=by,
+        title=title,
+        template=template,
+    )
+    fig.update_layout(bargap=0)
+    return fig
+
+
+ANOMALY_WINDOW = 7  # Days in the rolling mean/std of the statistical method
+ROLLING_ANOMALY_METHOD = "Statistical (Rolling Mean)"
+
+
+def detect_anomalies(city_df, method):
+    # One city's rows in date order with an Anomaly flag: AQI outside the
+    # rolling mean ± 2σ, or an Isolation Forest outlier
+    anom_df = city_df.sort_values("Date").copy()
+    if method == ROLLING_ANOMALY_METHOD:
+        rolling = anom_df["AQI"].rolling(window=ANOMALY_WINDOW)
+        anom_df["Rolling_Mean"] = rolling.mean()
+        anom_df["Rolling_Std"] = rolling.std()
+        anom_df["Upper_Bound"] = anom_df["Rolling_Mean"] + 2 * anom_df["Rolling_Std"]
+        anom_df["Lower_Bound"] = anom_df["Rolling_Mean"] - 2 * anom_df["Rolling_Std"]
+        anom_df["Anomaly"] = (anom_df["AQI"] > anom_df["Upper_Bound"]) | (
+            anom_df["AQI"] < anom_df["Lower_Bound"]
+        )
+    else:
+        # Fill NaNs for the model
+        X_anom = anom_df[["AQI"]].fillna(anom_df["AQI"].mean())
+        iso_forest = IsolationForest(contamination=0.05, random_state=42)
+        anom_df["Anomaly_Score"] = iso_forest.fit_predict(X_anom)
+        anom_df["Anomaly"] = anom_df["Anomaly_Score"] == -1
+    return anom_df
+
+
+def calendar_frame(city_df):
+    # Date, AQI and the calendar position (year, ISO week, weekday) of a city
+    cal_df = city_df[["Date", "AQI"]].copy()
+    cal_df["Year"] = cal_df["Date"].dt.year
+    cal_df["Week"] = cal_df["Date"].dt.isocalendar().week
+    cal_df["Weekday"] = cal_df["Date"].dt.day_name()
+    return cal_df
 
 
 # ---------------- SIDEBAR FILTERS FUNCTION ----------------
-def render_sidebar_filters(df):
+def reset_source_filters():
+    # City/date selections from one data source don't carry over to another
+    for key in ("manual_city", "selected_cities", "date_range"):
+        st.session_state.pop(key, None)
+
+
+def render_sidebar_filters(allow_datasets=False):
     st.sidebar.markdown("### Filters")
 
-    city_list = sorted(df["City"].dropna().unique())
+    data_version = get_data_version()
+
+    # Saved user datasets can stand in for aqi.db (Dashboard only)
+    source_df = None
+    source_key = (DATABASE_SOURCE, data_version)
+    if allow_datasets and st.session_state.get("logged_in"):
+        datasets = list_user_datasets(st.session_state.user)
+        if st.session_state.get("data_source") not in (DATABASE_SOURCE, *datasets):
+            # The selected dataset was deleted
+            st.session_state.pop("data_source", None)
+            reset_source_filters()
+        if datasets:
+            data_source = st.sidebar.selectbox(
+                "Data Source",
+                [DATABASE_SOURCE] + list(datasets),
+                key="data_source",
+                on_change=reset_source_filters,
+            )
+            if data_source in datasets:
+                path = datasets[data_source]
+                try:
+                    modified = os.path.getmtime(path)
+                    source_df = open_user_dataset(path, modified)
+                    # The path, not the name: it is per account, and the
+                    # LRU caches keyed on this are shared by every session
+                    source_key = (path, modified)
+                except OSError as e:
+                    print(f"Dataset Load Error: {e}")
+                if source_df is None:
+                    st.sidebar.error(f"Dataset '{data_source}' could not be opened.")
+
+    if source_df is None:
+        city_list = get_city_list(data_version)
+    else:
+        city_list = sorted(source_df["City"].unique().tolist())
 
     # 📍 Manual location selection
     st.sidebar.markdown("#### Select Location")
+    st.sidebar.text_input(
+        "Your Location",
+        key="user_location",
+        placeholder="Place name or lat, lon",
+    )
+    st.sidebar.button(
+        "📍 Nearest Station to Location",
+        on_click=select_nearest_station,
+        args=(city_list,),
+    )
+    if "location_note" in st.session_state:
+        st.sidebar.caption(st.session_state.location_note)
     manual_city = st.sidebar.selectbox("Choose your City", city_list, key="manual_city")
 
     suggested_city = manual_city
@@ -586,23 +2034,22 @@ def render_sidebar_filters(df):
 
     if st.sidebar.button("⭐ Save as Favorites"):
         if st.session_state.get("logged_in"):
-            conn = sqlite3.connect("aqi.db")
-            c = conn.cursor()
-            fav_str = ",".join(selected_cities)
-            c.execute(
-                "UPDATE users SET favorite_cities=? WHERE username=?",
-                (fav_str, st.session_state.user),
-            )
-            conn.commit()
-            conn.close()
+            with transaction() as c:
+                fav_str = ",".join(selected_cities)
+                c.execute(
+                    "UPDATE users SET favorite_cities=? WHERE username=?",
+                    (fav_str, st.session_state.user),
+                )
             st.session_state.favorite_cities = selected_cities
             st.toast("Favorites saved successfully!")
         else:
             st.error("Please login to save favorites.")
 
     # Date filter
-    min_date = df["Date"].min()
-    max_date = df["Date"].max()
+    if source_df is None:
+        min_date, max_date = get_date_bounds(data_version)
+    else:
+        min_date, max_date = source_df["Date"].min(), source_df["Date"].max()
 
     date_range = st.sidebar.date_input(
         "Select Date Range", [min_date, max_date], key="date_range"
@@ -612,15 +2059,22 @@ def render_sidebar_filters(df):
     st.sidebar.markdown("### Alerts")
     alert_threshold = st.sidebar.slider("AQI Alert Threshold", 50, 500, 200, 10)
 
-    # Apply filters
-    filtered_df = df[df["City"].isin(selected_cities)]
-
-    if len(date_range) == 2:
-        start_date, end_date = date_range
-        filtered_df = filtered_df[
-            (filtered_df["Date"] >= pd.to_datetime(start_date))
-            & (filtered_df["Date"] <= pd.to_datetime(end_date))
-        ]
+    # Apply filters (pushed down into the SQL query)
+    start_date, end_date = date_range_bounds(date_range)
+    if source_df is None:
+        filtered_df = get_filtered_data(
+            tuple(selected_cities), start_date, end_date, data_version
+        )
+    else:
+        filtered_df = filter_frame(source_df, selected_cities, start_date, end_date)
+    # Identifies this exact selection, e.g. for caching what is derived from
+    # it. Maps also depend on the station coordinates, hence their version.
+    filter_signature = source_key + (
+        get_stations_version(),
+        tuple(selected_cities),
+        start_date,
+        end_date,
+    )
 
     # Check for Alerts
     if not filtered_df.empty:
@@ -637,6 +2091,8 @@ def render_sidebar_filters(df):
         city_list,
         suggested_city,
         location_text,
+        source_df,
+        filter_signature,
     )
 
 
@@ -676,17 +2132,14 @@ if st.session_state.logged_in == False:
 
                 if submit_reset:
                     if new_pw_reset == confirm_pw_reset:
-                        conn = sqlite3.connect("aqi.db")
-                        cursor = conn.cursor()
-                        hashed_pw = bcrypt.hashpw(
-                            new_pw_reset.encode(), bcrypt.gensalt()
-                        ).decode()
-                        cursor.execute(
-                            "UPDATE users SET password=? WHERE username=?",
-                            (hashed_pw, reset_email_user),
-                        )
-                        conn.commit()
-                        conn.close()
+                        with transaction() as cursor:
+                            hashed_pw = bcrypt.hashpw(
+                                new_pw_reset.encode(), bcrypt.gensalt()
+                            ).decode()
+                            cursor.execute(
+                                "UPDATE users SET password=? WHERE username=?",
+                                (hashed_pw, reset_email_user),
+                            )
                         st.success("Password updated successfully! Please login.")
                         st.query_params.clear()
                     else:
@@ -1091,7 +2544,11 @@ if st.sidebar.button("Logout"):
     city_list,
     suggested_city,
     location_text,
-) = render_sidebar_filters(df)
+    source_df,
+    filter_signature,
+) = render_sidebar_filters(allow_datasets=menu == "Dashboard")
+data_version = get_data_version()
+start_date, end_date = date_range_bounds(date_range)
 
 # ---------------- LAYOUT CUSTOMIZATION ----------------
 st.sidebar.markdown("---")
@@ -1120,6 +2577,9 @@ selected_layout = st.sidebar.multiselect(
 # ---------------- DASHBOARD PAGE ----------------
 if menu == "Dashboard":
 
+    # Full history behind the filtered view: aqi.db or the selected saved dataset
+    dash_df = df if source_df is None else source_df
+
     if not filtered_df.empty and filtered_df["AQI"].max() > alert_threshold:
         st.error(
             f"**CRITICAL ALERT**: The AQI in the selected region has reached **{filtered_df['AQI'].max()}**, which exceeds your safety threshold of {alert_threshold}. Please take necessary precautions."
@@ -1180,17 +2640,32 @@ if menu == "Dashboard":
 
     st.write("### Selected Cities:", ", ".join(selected_cities))
 
-    # Excel Export
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        filtered_df.to_excel(writer, index=False, sheet_name="AQI Data")
-
+    # Excel Export (downloads are generated on click, then cached)
     st.download_button(
         label="Download Filtered Data (Excel)",
-        data=buffer,
+        data=cached_export(
+            ("xlsx", filter_signature), lambda: excel_export(filtered_df)
+        ),
         file_name="aqi_dashboard_data.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
+    render_columnar_downloads(filtered_df, filter_signature, "aqi_dashboard_data")
+
+    # Per-city means/variances for the selection, served from the rollups
+    # (saved datasets have none and are small enough to summarize directly)
+    if source_df is None:
+        city_stats = get_rollup_stats(
+            tuple(selected_cities), start_date, end_date, data_version
+        )
+    else:
+        city_stats = summarize_frame(filtered_df)
+
+    # Figures are cached per section and chart for this selection and theme;
+    # options are the chart's own widget values
+    def dashboard_figure(section, chart_id, build, *options):
+        return cached_figure(
+            (section, chart_id, filter_signature, chart_template) + options, build
+        )
 
     # ---------------- RENDER FUNCTIONS ----------------
     def render_overview():
@@ -1234,7 +2709,10 @@ if menu == "Dashboard":
         if pd.notna(latest_date):
             prev_date = latest_date - pd.Timedelta(days=1)
             # Get previous day data for the SAME selected cities from the full dataset
-            prev_df = df[(df["City"].isin(selected_cities)) & (df["Date"] == prev_date)]
+            prev_df = dash_df[
+                (dash_df["City"].isin(selected_cities))
+                & (dash_df["Date"] == prev_date)
+            ]
             if not prev_df.empty:
                 prev_aqi = prev_df["AQI"].mean()
                 aqi_delta = current_aqi - prev_aqi
@@ -1254,32 +2732,77 @@ if menu == "Dashboard":
         # Prepare data for animation
         map_df = filtered_df.copy()
         map_df = add_coordinates(map_df)
+        unplaced = sorted(map_df.loc[map_df["Lat"].isna(), "City"].unique())
+        if unplaced:
+            st.caption(
+                f"No station coordinates registered for: {', '.join(unplaced)}"
+            )
         map_df = map_df.dropna(subset=["Lat", "Lon"])
         # Ensure AQI is numeric and drop rows with missing coordinates or AQI
         map_df["AQI"] = pd.to_numeric(map_df["AQI"], errors="coerce")
         map_df = map_df.dropna(subset=["Lat", "Lon", "AQI"])
 
-        if not map_df.empty:
-            map_df["Date_Str"] = map_df["Date"].dt.strftime("%Y-%m-%d")
-            map_df = map_df.sort_values("Date")
+        # One view for the station maps below: only stations inside it are
+        # sent, merged into clusters unless that is switched off
+        map_view = render_map_view("dashboard_map", selected_cities)
+        map_df = view_frame(map_df[["City", "Date", "AQI", "Lat", "Lon"]], map_view)
+        # Plotly's maps count zoom in 512 px tiles, Leaflet's in 256 px ones
+        plotly_view = {
+            "center": dict(zip(["lat", "lon"], map_view["center"])),
+            "zoom": map_view["zoom"] - 1,
+        }
 
-            fig_anim_map = px.scatter_mapbox(
-                map_df,
-                lat="Lat",
-                lon="Lon",
-                size="AQI",
-                color="AQI",
-                animation_frame="Date_Str",
-                hover_name="City",
-                color_continuous_scale="RdYlGn_r",
-                size_max=40,
-                zoom=3.5,
-                mapbox_style="carto-positron",
-                title="AQI Changes Over Time",
+        if not map_df.empty:
+            # Frames are days, weeks or months, whichever stays within
+            # ANIMATION_MAX_FRAMES; a single week/month can be shown by day
+            map_grain = animation_grain(map_df["Date"])
+            frame_df = map_df
+            drill_window = None
+            if map_grain != "Day":
+                window_starts = np.unique(period_starts(map_df["Date"], map_grain))
+                window_labels = list(
+                    pd.DatetimeIndex(window_starts).strftime(
+                        ANIMATION_FRAME_FORMATS[map_grain]
+                    )
+                )
+                if st.session_state.get("map_drill_window") not in window_labels:
+                    st.session_state.pop("map_drill_window", None)
+                drill_window = st.selectbox(
+                    f"Frames are {map_grain.lower()}ly averages. Show daily frames for",
+                    [None] + window_labels,
+                    format_func=lambda label: "All dates" if label is None else label,
+                    key="map_drill_window",
+                )
+                if drill_window is not None:
+                    window_start = window_starts[window_labels.index(drill_window)]
+                    frame_df = map_df[
+                        period_starts(map_df["Date"], map_grain) == window_start
+                    ]
+                    map_grain = "Day"
+
+            fig_anim_map = dashboard_figure(
+                "maps",
+                "animation",
+                lambda: px.scatter_map(
+                    animation_frames(frame_df, map_grain),
+                    lat="Lat",
+                    lon="Lon",
+                    size="AQI",
+                    color="AQI",
+                    animation_frame="Frame",
+                    hover_name="City",
+                    color_continuous_scale="RdYlGn_r",
+                    size_max=40,
+                    map_style="carto-positron",
+                    title="AQI Changes Over Time",
+                    **plotly_view,
+                ),
+                drill_window,
+                map_view["key"],
             )
             st.plotly_chart(fig_anim_map, use_container_width=True)
         else:
-            st.warning("Not enough location data available for the map.")
+            st.warning("No located stations with AQI data in this map view.")
 
         st.write("---")
         st.markdown(
@@ -1288,60 +2811,34 @@ if menu == "Dashboard":
         )
 
         if not map_df.empty:
-            # Prepare features for TimestampedGeoJson
-            features = []
-            for _, row in map_df.iterrows():
-                # Determine color based on AQI
-                color = "green"
-                if row["AQI"] > 300:
-                    color = "red"
-                elif row["AQI"] > 200:
-                    color = "purple"
-                elif row["AQI"] > 100:
-                    color = "orange"
-                elif row["AQI"] > 50:
-                    color = "yellow"
-
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [row["Lon"], row["Lat"]],
-                    },
-                    "properties": {
-                        "time": row["Date"].strftime("%Y-%m-%d"),
-                        "style": {"color": color},
-                        "icon": "circle",
-                        "iconstyle": {
-                            "fillColor": color,
-                            "fillOpacity": 0.8,
-                            "stroke": "true",
-                            "radius": 10,
-                        },
-                        "popup": f"{row['City']}: {row['AQI']}",
-                    },
-                }
-                features.append(feature)
 
-            # Create Map
-            m_anim = folium.Map(
-                location=[20.5937, 78.9629], zoom_start=4, tiles="CartoDB dark_matter"
+            def build_timelapse():
+                m_anim = folium.Map(
+                    location=list(map_view["center"]),
+                    zoom_start=map_view["zoom"],
+                    tiles="CartoDB dark_matter",
+                )
+                TimestampedGeoJson(
+                    {"type": "FeatureCollection", "features": timelapse_features(map_df)},
+                    period="P1D",
+                    add_last_point=True,
+                    auto_play=False,
+                    loop=False,
+                    max_speed=1,
+                    loop_button=True,
+                    date_options="YYYY-MM-DD",
+                    time_slider_drag_update=True,
+                ).add_to(m_anim)
+                return map_html(m_anim)
+
+            st_html(
+                cached_html(
+                    ("maps", "timelapse", filter_signature, map_view["key"]),
+                    build_timelapse,
+                ),
+                height=500,
             )
 
-            TimestampedGeoJson(
-                {"type": "FeatureCollection", "features": features},
-                period="P1D",
-                add_last_point=True,
-                auto_play=False,
-                loop=False,
-                max_speed=1,
-                loop_button=True,
-                date_options="YYYY-MM-DD",
-                time_slider_drag_update=True,
-            ).add_to(m_anim)
-
-            st_html(m_anim._repr_html_(), height=500)
-
         st.write("---")
         st.markdown(
             "<h3 class='gradient-text'>Real-Time Wind Analysis (Speed & Direction)</h3>",
@@ -1349,36 +2846,56 @@ if menu == "Dashboard":
         )
 
         if selected_cities:
-            # Create base map centered on the first selected city
-            first_city_coords = CITY_COORDINATES.get(
-                selected_cities[0], [20.5937, 78.9629]
-            )
+            # Latest AQI per city, for the cluster markers
+            latest_aqi = filtered_df.sort_values("Date").drop_duplicates(
+                "City", keep="last"
+            )[["City", "AQI"]]
+            wind_points = add_coordinates(
+                pd.DataFrame({"City": selected_cities}).merge(
+                    latest_aqi, on="City", how="left"
+                )
+            ).dropna(subset=["Lat", "Lon"])
+            wind_points = view_frame(wind_points, map_view)
             wind_map = folium.Map(
-                location=first_city_coords, zoom_start=5, tiles="CartoDB dark_matter"
+                location=list(map_view["center"]),
+                zoom_start=map_view["zoom"],
+                tiles="CartoDB dark_matter",
             )
 
-            for city in selected_cities:
-                coords = CITY_COORDINATES.get(city)
-                if coords:
-                    w_data = get_weather_data(city)
-                    if w_data:
-                        # Add Wind Marker (Arrow)
-                        folium.Marker(
-                            location=coords,
-                            icon=get_wind_arrow_icon(
-                                w_data["wind_dir"], w_data["wind"]
-                            ),
-                            tooltip=f"<b>{city}</b><br>Wind: {w_data['wind']} km/h<br>Dir: {w_data['wind_dir']}°",
-                        ).add_to(wind_map)
-
-                        # Add Circle for context
-                        folium.CircleMarker(
-                            location=coords,
-                            radius=10,
-                            color="#333",
-                            fill=True,
-                            fill_opacity=0.4,
-                        ).add_to(wind_map)
+            for point in wind_points.itertuples():
+                coords = [point.Lat, point.Lon]
+                if point.Stations > 1:
+                    # Weather is only fetched for single stations; a cluster
+                    # shows its size and mean AQI until zoomed into
+                    mean_aqi = "n/a" if pd.isna(point.AQI) else f"{point.AQI:.0f}"
+                    folium.CircleMarker(
+                        location=coords,
+                        radius=10 + 2 * np.log2(point.Stations),
+                        color="#00c9ff",
+                        fill=True,
+                        fill_opacity=0.5,
+                        tooltip=f"<b>{point.City}</b><br>{point.Stations} stations, "
+                        f"mean AQI {mean_aqi}<br>Zoom in for wind",
+                    ).add_to(wind_map)
+                    continue
+
+                w_data = get_weather_data(point.City)
+                if w_data:
+                    # Add Wind Marker (Arrow)
+                    folium.Marker(
+                        location=coords,
+                        icon=get_wind_arrow_icon(w_data["wind_dir"], w_data["wind"]),
+                        tooltip=f"<b>{point.City}</b><br>Wind: {w_data['wind']} km/h<br>Dir: {w_data['wind_dir']}°",
+                    ).add_to(wind_map)
+
+                    # Add Circle for context
+                    folium.CircleMarker(
+                        location=coords,
+                        radius=10,
+                        color="#333",
+                        fill=True,
+                        fill_opacity=0.4,
+                    ).add_to(wind_map)
 
             st_html(wind_map._repr_html_(), height=500)
 
@@ -1388,33 +2905,55 @@ if menu == "Dashboard":
             unsafe_allow_html=True,
         )
 
-        if not filtered_df.empty:
-            # Use the latest date in the filtered dataset for the snapshot
-            latest_date_in_view = filtered_df["Date"].max()
-            heatmap_df = filtered_df[filtered_df["Date"] == latest_date_in_view]
-
-            # Prepare data: [Lat, Lon, Weight (AQI)]
-            heat_data = []
-            for _, row in heatmap_df.iterrows():
-                coords = CITY_COORDINATES.get(row["City"])
-                if coords and pd.notnull(row["AQI"]):
-                    heat_data.append([coords[0], coords[1], row["AQI"]])
-
-            if heat_data:
-                # Center map on the first data point
-                start_loc = [heat_data[0][0], heat_data[0][1]]
+        surface_df = add_coordinates(
+            filtered_df[["City", "Date", "AQI"]].dropna(subset=["AQI"])
+        ).dropna(subset=["Lat", "Lon"])
+        if not surface_df.empty:
+            surface_dates = list(np.unique(surface_df["Date"].dt.strftime("%Y-%m-%d")))
+            if st.session_state.get("surface_date") not in surface_dates:
+                st.session_state.pop("surface_date", None)
+            surface_date = (
+                st.select_slider(
+                    "Snapshot date",
+                    surface_dates,
+                    value=surface_dates[-1],
+                    key="surface_date",
+                )
+                if len(surface_dates) > 1
+                else surface_dates[0]
+            )
+            snapshot = surface_df[surface_df["Date"] == pd.Timestamp(surface_date)]
+
+            def build_surface_map():
+                # AQI interpolated between stations (IDW), as one PNG overlay
+                south, west, north, east = SURFACE_BOUNDS
                 m_heat = folium.Map(
-                    location=start_loc, zoom_start=5, tiles="CartoDB dark_matter"
+                    location=[20.5937, 78.9629], zoom_start=5, tiles="CartoDB dark_matter"
                 )
-                HeatMap(
-                    heat_data,
-                    radius=25,
-                    blur=15,
-                    gradient={0.4: "blue", 0.65: "lime", 1: "red"},
+                folium.raster_layers.ImageOverlay(
+                    image=surface_image(
+                        idw_surface(snapshot["Lat"], snapshot["Lon"], snapshot["AQI"])
+                    ),
+                    bounds=[[south, west], [north, east]],
+                    interactive=False,
                 ).add_to(m_heat)
-                st_html(m_heat._repr_html_(), height=500)
-            else:
-                st.info("Insufficient data for heatmap visualization.")
+                return map_html(m_heat)
+
+            st_html(
+                cached_html(
+                    ("maps", "surface", filter_signature, surface_date),
+                    build_surface_map,
+                ),
+                height=500,
+            )
+            st.caption(
+                f"AQI interpolated from the {len(snapshot)} station(s) reporting on "
+                f"{surface_date} (inverse-distance weighting of the "
+                f"{IDW_NEIGHBOURS} nearest), coloured by CPCB band; areas over "
+                f"{IDW_MAX_DISTANCE:g} degrees from any station are left clear."
+            )
+        else:
+            st.info("Insufficient data for heatmap visualization.")
 
     def render_trends():
         st.write("---")
@@ -1422,17 +2961,31 @@ if menu == "Dashboard":
             "<h3 class='gradient-text'>AQI Trend (Multi City Comparison)</h3>",
             unsafe_allow_html=True,
         )
-        fig_line = px.line(filtered_df, x="Date", y="AQI", color="City", markers=True)
+        fig_line = dashboard_figure(
+            "trends",
+            "line",
+            lambda: px.line(
+                downsample_lines(filtered_df, "Date", "AQI", "City"),
+                x="Date",
+                y="AQI",
+                color="City",
+                markers=True,
+            ),
+        )
         st.plotly_chart(fig_line, use_container_width=True, config=plotly_config)
+        trend_points = sum(len(trace.x) for trace in fig_line.data)
+        if trend_points < len(filtered_df):
+            st.caption(
+                f"Showing {trend_points:,} of {len(filtered_df):,} points (shape-preserving "
+                "downsampling). Narrow the date range for full resolution."
+            )
 
         # Feature: Download Chart as HTML
-        buffer_html = io.StringIO()
-        fig_line.write_html(buffer_html)
-        html_bytes = buffer_html.getvalue().encode()
-
         st.download_button(
             label="Download Interactive Chart (HTML)",
-            data=html_bytes,
+            data=cached_export(
+                ("trend_html", filter_signature), lambda: html_export(fig_line)
+            ),
             file_name="aqi_trend_chart.html",
             mime="text/html",
         )
@@ -1440,7 +2993,9 @@ if menu == "Dashboard":
         # Export Data CSV
         st.download_button(
             label="Download Trend Data (CSV)",
-            data=filtered_df.to_csv(index=False).encode("utf-8"),
+            data=cached_export(
+                ("csv", filter_signature), lambda: csv_export(filtered_df, index=False)
+            ),
             file_name="aqi_trend_data.csv",
             mime="text/csv",
         )
@@ -1452,7 +3007,9 @@ if menu == "Dashboard":
                 "<h3 class='gradient-text'>AQI Category Distribution</h3>",
                 unsafe_allow_html=True,
             )
-            fig_pie = px.pie(filtered_df, names="AQI_Category")
+            fig_pie = dashboard_figure(
+                "trends", "pie", lambda: px.pie(filtered_df, names="AQI_Category")
+            )
             st.plotly_chart(fig_pie, use_container_width=True, config=plotly_config)
 
         with colB:
@@ -1460,8 +3017,16 @@ if menu == "Dashboard":
                 "<h3 class='gradient-text'>Average AQI by City</h3>",
                 unsafe_allow_html=True,
             )
-            avg_city = filtered_df.groupby("City")["AQI"].mean().reset_index()
-            fig_bar = px.bar(avg_city, x="City", y="AQI", text_auto=True)
+            fig_bar = dashboard_figure(
+                "trends",
+                "city_bar",
+                lambda: px.bar(
+                    city_stats["mean"]["AQI"].reset_index(),
+                    x="City",
+                    y="AQI",
+                    text_auto=True,
+                ),
+            )
             st.plotly_chart(fig_bar, use_container_width=True, config=plotly_config)
 
     def render_pollutant_analysis():
@@ -1471,14 +3036,18 @@ if menu == "Dashboard":
             unsafe_allow_html=True,
         )
         pollutants = ["PM25", "PM10", "NO2", "SO2", "CO", "O3"]
-        heatmap_data = filtered_df.groupby("City")[pollutants].mean()
-        fig_heat = px.imshow(heatmap_data, text_auto=True)
+        heatmap_data = city_stats["mean"][pollutants]
+        fig_heat = dashboard_figure(
+            "pollutants", "heatmap", lambda: px.imshow(heatmap_data, text_auto=True)
+        )
         st.plotly_chart(fig_heat, use_container_width=True, config=plotly_config)
 
         # Export Heatmap Data
         st.download_button(
             label="Download Pollutant Analysis Data (CSV)",
-            data=heatmap_data.to_csv().encode("utf-8"),
+            data=cached_export(
+                ("pollutant_csv", filter_signature), lambda: csv_export(heatmap_data)
+            ),
             file_name="pollutant_analysis.csv",
             mime="text/csv",
         )
@@ -1496,13 +3065,16 @@ if menu == "Dashboard":
             valid_cols = [c for c in corr_cols if c in filtered_df.columns]
 
             if len(valid_cols) > 1:
-                corr_matrix = filtered_df[valid_cols].corr()
-                fig_corr = px.imshow(
-                    corr_matrix,
-                    text_auto=True,
-                    color_continuous_scale="RdBu_r",
-                    title="Correlation between Pollutants & AQI",
-                    template=chart_template,
+                fig_corr = dashboard_figure(
+                    "pollutants",
+                    "correlation",
+                    lambda: px.imshow(
+                        filtered_df[valid_cols].corr(),
+                        text_auto=True,
+                        color_continuous_scale="RdBu_r",
+                        title="Correlation between Pollutants & AQI",
+                        template=chart_template,
+                    ),
                 )
                 st.plotly_chart(
                     fig_corr, use_container_width=True, config=plotly_config
@@ -1515,16 +3087,34 @@ if menu == "Dashboard":
             unsafe_allow_html=True,
         )
 
-        if not filtered_df.empty:
-            fig_scatter = px.scatter(
-                filtered_df,
-                x="PM25",
-                y="AQI",
-                color="AQI_Category",
-                hover_data=["City", "Date"],
-                title="Impact of PM2.5 on AQI Levels",
-                template=chart_template,
+        # Large selections are drawn from aggregates instead of every row
+        large_data = len(filtered_df) > DEEP_DIVE_RAW_ROWS
+        if large_data:
+            st.caption(
+                f"{len(filtered_df):,} rows selected: charts below are drawn from "
+                "binned counts and box statistics."
             )
+
+        if not filtered_df.empty:
+            if large_data:
+                build_scatter = lambda: density_figure(
+                    filtered_df,
+                    "PM25",
+                    "AQI",
+                    "Impact of PM2.5 on AQI Levels (density)",
+                    chart_template,
+                )
+            else:
+                build_scatter = lambda: px.scatter(
+                    filtered_df,
+                    x="PM25",
+                    y="AQI",
+                    color="AQI_Category",
+                    hover_data=["City", "Date"],
+                    title="Impact of PM2.5 on AQI Levels",
+                    template=chart_template,
+                )
+            fig_scatter = dashboard_figure("deep_dive", "scatter", build_scatter)
             st.plotly_chart(fig_scatter, use_container_width=True, config=plotly_config)
 
         st.write("---")
@@ -1534,14 +3124,20 @@ if menu == "Dashboard":
         )
 
         if not filtered_df.empty:
-            fig_box = px.box(
-                filtered_df,
-                x="City",
-                y="AQI",
-                color="City",
-                title="AQI Distribution & Variability",
-                template=chart_template,
-            )
+            if large_data:
+                build_box = lambda: box_stats_figure(
+                    filtered_df, "City", "AQI", "AQI Distribution & Variability", chart_template
+                )
+            else:
+                build_box = lambda: px.box(
+                    filtered_df,
+                    x="City",
+                    y="AQI",
+                    color="City",
+                    title="AQI Distribution & Variability",
+                    template=chart_template,
+                )
+            fig_box = dashboard_figure("deep_dive", "box", build_box)
             st.plotly_chart(fig_box, use_container_width=True, config=plotly_config)
 
         st.write("---")
@@ -1551,20 +3147,29 @@ if menu == "Dashboard":
         )
 
         if not filtered_df.empty:
-            fig_hist = px.histogram(
-                filtered_df,
-                x="AQI",
-                color="City",
-                title="Distribution of AQI Values",
-                template=chart_template,
-            )
+            if large_data:
+                build_hist = lambda: histogram_figure(
+                    filtered_df, "AQI", "City", "Distribution of AQI Values", chart_template
+                )
+            else:
+                build_hist = lambda: px.histogram(
+                    filtered_df,
+                    x="AQI",
+                    color="City",
+                    title="Distribution of AQI Values",
+                    template=chart_template,
+                )
+            fig_hist = dashboard_figure("deep_dive", "histogram", build_hist)
             st.plotly_chart(fig_hist, use_container_width=True, config=plotly_config)
 
         # Export Deep Dive Data
         if not filtered_df.empty:
             st.download_button(
                 label="Download Deep Dive Data (CSV)",
-                data=filtered_df.to_csv(index=False).encode("utf-8"),
+                data=cached_export(
+                    ("csv", filter_signature),
+                    lambda: csv_export(filtered_df, index=False),
+                ),
                 file_name="deep_dive_data.csv",
                 mime="text/csv",
             )
@@ -1582,33 +3187,32 @@ if menu == "Dashboard":
                 filtered_df["City"].unique(),
                 key="decomposition_city",
             )
-            decomposition_df = filtered_df[
-                filtered_df["City"] == city_for_decomposition
-            ].set_index("Date")
-
-            if not decomposition_df.empty:
-                # Ensure the DataFrame has a DatetimeIndex
-                if not isinstance(decomposition_df.index, pd.DatetimeIndex):
-                    decomposition_df.index = pd.to_datetime(decomposition_df.index)
-
-                # Sort DataFrame by date
-                decomposition_df = decomposition_df.sort_index()
 
-                # Perform seasonal decomposition using moving averages
-                rolling_window = 30  # Adjust as needed
-                decomposition = (
-                    decomposition_df["AQI"]
-                    .rolling(window=rolling_window, center=True)
-                    .mean()
+            def seasonal_trend():
+                # Seasonal decomposition using moving averages
+                decomposition_df = (
+                    filtered_df[filtered_df["City"] == city_for_decomposition]
+                    .set_index("Date")
+                    .sort_index()
                 )
-
-                # Create plot
-                fig_seasonal = px.line(
-                    x=decomposition_df.index,
+                rolling_window = 30  # Adjust as needed
+                return decomposition_df["AQI"].rolling(
+                    window=rolling_window, center=True
+                ).mean()
+
+            def build_seasonal():
+                decomposition = seasonal_trend()
+                return px.line(
+                    x=decomposition.index,
                     y=decomposition,
                     title=f"Seasonal Decomposition of AQI in {city_for_decomposition}",
                     labels={"x": "Date", "y": "Trend"},
                 )
+
+            if (filtered_df["City"] == city_for_decomposition).any():
+                fig_seasonal = dashboard_figure(
+                    "advanced", "seasonal", build_seasonal, city_for_decomposition
+                )
                 st.plotly_chart(
                     fig_seasonal, use_container_width=True, config=plotly_config
                 )
@@ -1616,11 +3220,12 @@ if menu == "Dashboard":
                 # Export Seasonal Data
                 st.download_button(
                     label="Download Seasonal Trend (CSV)",
-                    data=pd.DataFrame(
-                        {"Date": decomposition_df.index, "Trend": decomposition}
-                    )
-                    .to_csv(index=False)
-                    .encode("utf-8"),
+                    data=cached_export(
+                        ("seasonal_csv", filter_signature, city_for_decomposition),
+                        lambda: csv_export(
+                            seasonal_trend().rename("Trend").reset_index(), index=False
+                        ),
+                    ),
                     file_name=f"seasonal_trend_{city_for_decomposition}.csv",
                     mime="text/csv",
                 )
@@ -1650,59 +3255,52 @@ if menu == "Dashboard":
                 anomaly_method = st.selectbox(
                     "Detection Method",
                     [
-                        "Statistical (Rolling Mean)",
+                        ROLLING_ANOMALY_METHOD,
                         "Machine Learning (Isolation Forest)",
                     ],
                     key="anomaly_method",
                 )
 
-            # Prepare data
-            anom_df = df[df["City"] == anomaly_city].sort_values("Date").copy()
-
-            if anomaly_method == "Statistical (Rolling Mean)":
-                # Calculate Rolling Stats (e.g., 7-day window)
-                window = 7
-                anom_df["Rolling_Mean"] = anom_df["AQI"].rolling(window=window).mean()
-                anom_df["Rolling_Std"] = anom_df["AQI"].rolling(window=window).std()
-
-                # Define Bounds
-                anom_df["Upper_Bound"] = anom_df["Rolling_Mean"] + (
-                    2 * anom_df["Rolling_Std"]
-                )
-                anom_df["Lower_Bound"] = anom_df["Rolling_Mean"] - (
-                    2 * anom_df["Rolling_Std"]
-                )
-
-                # Identify Anomalies
-                anom_df["Anomaly"] = (anom_df["AQI"] > anom_df["Upper_Bound"]) | (
-                    anom_df["AQI"] < anom_df["Lower_Bound"]
-                )
+            # The detection itself (rolling stats or the model fit) is cached
+            # with the charts, under the same filter signature
+            anom_df = cached_frame(
+                (
+                    "advanced",
+                    "anomaly_frame",
+                    filter_signature,
+                    anomaly_city,
+                    anomaly_method,
+                ),
+                lambda: detect_anomalies(
+                    dash_df[dash_df["City"] == anomaly_city], anomaly_method
+                ),
+            )
+            if anomaly_method == ROLLING_ANOMALY_METHOD:
                 title_text = f"AQI Anomalies in {anomaly_city} (Rolling Mean ± 2σ)"
             else:
-                # Machine Learning: Isolation Forest
-                # Fill NaNs for ML model
-                X_anom = anom_df[["AQI"]].fillna(anom_df["AQI"].mean())
-                iso_forest = IsolationForest(contamination=0.05, random_state=42)
-                anom_df["Anomaly_Score"] = iso_forest.fit_predict(X_anom)
-                anom_df["Anomaly"] = anom_df["Anomaly_Score"] == -1
                 title_text = f"AQI Anomalies in {anomaly_city} (Isolation Forest)"
 
             anomalies = anom_df[anom_df["Anomaly"]]
 
             # Plot
-            fig_anom = px.line(
-                anom_df,
-                x="Date",
-                y="AQI",
-                title=title_text,
-                template=chart_template,
-            )
-            fig_anom.add_scatter(
-                x=anomalies["Date"],
-                y=anomalies["AQI"],
-                mode="markers",
-                name="Anomaly",
-                marker=dict(color="red", size=10, symbol="x"),
+            fig_anom = dashboard_figure(
+                "advanced",
+                "anomalies",
+                lambda: px.line(
+                    anom_df,
+                    x="Date",
+                    y="AQI",
+                    title=title_text,
+                    template=chart_template,
+                ).add_scatter(
+                    x=anomalies["Date"],
+                    y=anomalies["AQI"],
+                    mode="markers",
+                    name="Anomaly",
+                    marker=dict(color="red", size=10, symbol="x"),
+                ),
+                anomaly_city,
+                anomaly_method,
             )
             st.plotly_chart(fig_anom, use_container_width=True, config=plotly_config)
 
@@ -1717,7 +3315,15 @@ if menu == "Dashboard":
                 # Export Anomalies
                 st.download_button(
                     label="Download Detected Anomalies (CSV)",
-                    data=anomalies.to_csv(index=False).encode("utf-8"),
+                    data=cached_export(
+                        (
+                            "anomalies_csv",
+                            filter_signature,
+                            anomaly_city,
+                            anomaly_method,
+                        ),
+                        lambda: csv_export(anomalies, index=False),
+                    ),
                     file_name=f"anomalies_{anomaly_city}.csv",
                     mime="text/csv",
                 )
@@ -1737,14 +3343,13 @@ if menu == "Dashboard":
                 "Select City for Calendar View", cal_city_options, key="cal_city_select"
             )
 
-            # Use full dataset 'df' to show full year history, ignoring dashboard date filter
-            cal_df = df[df["City"] == cal_city].copy()
+            # Use full dataset 'dash_df' to show full year history, ignoring dashboard date filter
+            cal_df = cached_frame(
+                ("advanced", "calendar_frame", filter_signature, cal_city),
+                lambda: calendar_frame(dash_df[dash_df["City"] == cal_city]),
+            )
 
             if not cal_df.empty:
-                cal_df["Year"] = cal_df["Date"].dt.year
-                cal_df["Week"] = cal_df["Date"].dt.isocalendar().week
-                cal_df["Weekday"] = cal_df["Date"].dt.day_name()
-
                 available_years = sorted(cal_df["Year"].unique())
                 if available_years:
                     selected_year = st.selectbox(
@@ -1753,30 +3358,37 @@ if menu == "Dashboard":
                         index=len(available_years) - 1,
                         key="cal_year_select",
                     )
-                    cal_df_year = cal_df[cal_df["Year"] == selected_year]
-
-                    weekday_order = [
-                        "Monday",
-                        "Tuesday",
-                        "Wednesday",
-                        "Thursday",
-                        "Friday",
-                        "Saturday",
-                        "Sunday",
-                    ]
-                    heatmap_data_cal = cal_df_year.pivot_table(
-                        index="Weekday", columns="Week", values="AQI", aggfunc="mean"
-                    )
-                    heatmap_data_cal = heatmap_data_cal.reindex(weekday_order)
 
-                    fig_cal = px.imshow(
-                        heatmap_data_cal,
-                        labels=dict(x="Week of Year", y="Day of Week", color="AQI"),
-                        title=f"AQI Intensity Calendar - {cal_city} ({selected_year})",
-                        color_continuous_scale="RdYlGn_r",  # Green (Good) to Red (Bad)
-                        template=chart_template,
+                    def build_calendar():
+                        cal_df_year = cal_df[cal_df["Year"] == selected_year]
+
+                        weekday_order = [
+                            "Monday",
+                            "Tuesday",
+                            "Wednesday",
+                            "Thursday",
+                            "Friday",
+                            "Saturday",
+                            "Sunday",
+                        ]
+                        heatmap_data_cal = cal_df_year.pivot_table(
+                            index="Weekday", columns="Week", values="AQI", aggfunc="mean"
+                        )
+                        heatmap_data_cal = heatmap_data_cal.reindex(weekday_order)
+
+                        fig_cal = px.imshow(
+                            heatmap_data_cal,
+                            labels=dict(x="Week of Year", y="Day of Week", color="AQI"),
+                            title=f"AQI Intensity Calendar - {cal_city} ({selected_year})",
+                            color_continuous_scale="RdYlGn_r",  # Green (Good) to Red (Bad)
+                            template=chart_template,
+                        )
+                        fig_cal.update_layout(height=400)
+                        return fig_cal
+
+                    fig_cal = dashboard_figure(
+                        "advanced", "calendar", build_calendar, cal_city, selected_year
                     )
-                    fig_cal.update_layout(height=400)
                     st.plotly_chart(
                         fig_cal, use_container_width=True, config=plotly_config
                     )
@@ -1814,16 +3426,18 @@ elif menu == "City Comparison":
         comp_df = df[df["City"].isin(comp_cities)]
 
         # Date Filter Application
-        if len(date_range) == 2:
-            start_date, end_date = date_range
+        if start_date and end_date:
             comp_df = comp_df[
                 (comp_df["Date"] >= pd.to_datetime(start_date))
                 & (comp_df["Date"] <= pd.to_datetime(end_date))
             ]
+        comp_stats = get_rollup_stats(
+            tuple(comp_cities), start_date, end_date, data_version
+        )
 
         # Metrics Summary
         st.markdown("### Average AQI Summary")
-        avg_data = comp_df.groupby("City")["AQI"].mean().reset_index()
+        avg_data = comp_stats["mean"]["AQI"].reset_index()
 
         # Display metrics in columns if few cities, else dataframe
         if len(comp_cities) <= 4:
@@ -1841,7 +3455,7 @@ elif menu == "City Comparison":
             unsafe_allow_html=True,
         )
         fig_comp = px.line(
-            comp_df,
+            downsample_lines(comp_df, "Date", "AQI", "City"),
             x="Date",
             y="AQI",
             color="City",
@@ -1855,7 +3469,7 @@ elif menu == "City Comparison":
             unsafe_allow_html=True,
         )
         pollutants = ["PM25", "PM10", "NO2", "SO2", "CO", "O3"]
-        p_data = comp_df.groupby("City")[pollutants].mean().reset_index()
+        p_data = comp_stats["mean"][pollutants].reset_index()
         p_data = pd.melt(
             p_data, id_vars=["City"], var_name="Pollutant", value_name="Concentration"
         )
@@ -1886,29 +3500,22 @@ elif menu == "City Comparison":
             unsafe_allow_html=True,
         )
 
-        map_data = []
-        for idx, row in avg_data.iterrows():
-            coords = CITY_COORDINATES.get(row["City"], [None, None])
-            if coords[0] is not None:
-                map_data.append(
-                    {
-                        "City": row["City"],
-                        "Lat": coords[0],
-                        "Lon": coords[1],
-                        "AQI": row["AQI"],
-                    }
-                )
+        comp_view = render_map_view("comparison_map", comp_cities)
+        map_df = view_frame(
+            add_coordinates(avg_data).dropna(subset=["Lat", "Lon"]), comp_view
+        )
 
-        if map_data:
-            map_df = pd.DataFrame(map_data)
-            fig_map = px.scatter_mapbox(
+        if not map_df.empty:
+            fig_map = px.scatter_map(
                 map_df,
                 lat="Lat",
                 lon="Lon",
                 size="AQI",
                 color="City",
-                zoom=4,
-                mapbox_style="open-street-map",
+                hover_data=["Stations"],
+                center=dict(zip(["lat", "lon"], comp_view["center"])),
+                zoom=comp_view["zoom"] - 1,  # Plotly counts zoom in 512 px tiles
+                map_style="open-street-map",
                 title="City Locations & AQI Severity",
                 size_max=30,
                 template=chart_template,
@@ -1925,7 +3532,8 @@ elif menu == "City Comparison":
         )
 
         # Calculate Global Average (Mean of all AQI records in DB)
-        global_aqi_avg = df["AQI"].mean()
+        all_stats = get_rollup_stats(data_version=data_version)
+        global_aqi_avg = all_stats["sum"]["AQI"].sum() / all_stats["count"]["AQI"].sum()
 
         # Select City for Comparison
         comp_city_single = st.selectbox(
@@ -1935,7 +3543,7 @@ elif menu == "City Comparison":
         )
 
         if comp_city_single:
-            city_aqi_avg = df[df["City"] == comp_city_single]["AQI"].mean()
+            city_aqi_avg = all_stats["mean"]["AQI"].get(comp_city_single, np.nan)
 
             col_g1, col_g2, col_g3 = st.columns(3)
             col_g1.metric(f"{comp_city_single} Average", round(city_aqi_avg, 2))
@@ -1984,7 +3592,7 @@ elif menu == "Health Advice":
 
             st.metric(
                 label=f"Current AQI in {h_city}",
-                value=latest_aqi,
+                value=None if pd.isna(latest_aqi) else latest_aqi,
                 delta=cat,
                 delta_color="inverse",
             )
@@ -2103,21 +3711,29 @@ elif menu == "Prediction":
         pred_val = round(prediction[0], 2)
 
         st.success(f"Predicted AQI = {pred_val}")
-
-        # AQI Category Function
-        def aqi_category(aqi):
-            if aqi <= 50:
-                return "Good"
-            elif aqi <= 100:
-                return "Moderate"
-            elif aqi <= 200:
-                return "Unhealthy"
-            elif aqi <= 300:
-                return "Very Unhealthy"
-            else:
-                return "Hazardous"
-
         st.info(f"AQI Category: {aqi_category(pred_val)}")
+
+        # Reference value from the CPCB sub-index formula for the same inputs
+        cpcb = compute_aqi(
+            pd.DataFrame(
+                [
+                    {
+                        "PM25": pm25,
+                        "PM10": pm10,
+                        "NO2": no2,
+                        "SO2": so2,
+                        "CO": co,
+                        "O3": o3,
+                    }
+                ]
+            )
+        ).iloc[0]
+        if pd.notna(cpcb["AQI"]):
+            st.write(
+                f"CPCB AQI (sub-index method): {round(cpcb['AQI'], 2)} "
+                f"({aqi_category(cpcb['AQI'])}), dominant pollutant: "
+                f"{cpcb['Dominant_Pollutant']}"
+            )
 # ---------------- NEWS FEED PAGE ----------------
 elif menu == "News Feed":
     st.markdown(
@@ -2200,7 +3816,75 @@ elif menu == "Raw Data":
     st.markdown(
         "<h1 class='gradient-text'>Raw Data Viewer</h1>", unsafe_allow_html=True
     )
-    st.dataframe(filtered_df)
+
+    # Paged in SQLite: only the visible page is read and sent to the browser
+    col_r1, col_r2, col_r3, col_r4 = st.columns([3, 2, 2, 1])
+    with col_r1:
+        raw_search = st.text_input(
+            "Search", placeholder="City or date, e.g. Delhi or 2023-05", key="raw_search"
+        ).strip()
+    with col_r2:
+        raw_sort = st.selectbox("Sort By", RAW_SORT_COLUMNS, key="raw_sort")
+    with col_r3:
+        raw_descending = (
+            st.selectbox("Order", ["Ascending", "Descending"], key="raw_order")
+            == "Descending"
+        )
+    with col_r4:
+        raw_page_size = st.selectbox("Rows", RAW_PAGE_SIZES, key="raw_page_size")
+
+    # Start of each page visited so far; any change of query starts over
+    raw_query = (filter_signature, raw_search, raw_sort, raw_descending, raw_page_size)
+    if st.session_state.get("raw_query") != raw_query:
+        st.session_state.raw_query = raw_query
+        st.session_state.raw_cursors = [None]
+    raw_cursors = st.session_state.raw_cursors
+
+    raw_filter = (tuple(selected_cities), start_date, end_date, raw_search)
+    raw_total = count_raw_rows(*raw_filter, data_version)
+    raw_page = get_raw_page(
+        *raw_filter,
+        raw_sort,
+        raw_descending,
+        raw_cursors[-1],
+        raw_page_size,
+        data_version,
+    )
+    has_next_page = len(raw_page) > raw_page_size
+    raw_page = raw_page.iloc[:raw_page_size]
+
+    st.dataframe(
+        prepare_aqi_frame(raw_page.drop(columns=["id", "sort_key"])),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    col_p1, col_p2, col_p3 = st.columns([1, 3, 1])
+    with col_p1:
+        st.button(
+            "⬅️ Previous",
+            disabled=len(raw_cursors) == 1,
+            on_click=raw_cursors.pop,
+            use_container_width=True,
+        )
+    with col_p2:
+        raw_pages = max(1, -(-raw_total // raw_page_size))
+        st.caption(
+            f"Page {len(raw_cursors):,} of {raw_pages:,} · {raw_total:,} matching rows"
+        )
+    with col_p3:
+        next_cursor = None
+        if has_next_page:
+            next_cursor = (raw_page["sort_key"].iloc[-1], int(raw_page["id"].iloc[-1]))
+        st.button(
+            "Next ➡️",
+            disabled=not has_next_page,
+            on_click=raw_cursors.append,
+            args=(next_cursor,),
+            use_container_width=True,
+        )
+
+    render_columnar_downloads(filtered_df, filter_signature, "aqi_raw_data")
 
 # ---------------- UPLOAD DATA PAGE ----------------
 elif menu == "Upload Data":
@@ -2216,10 +3900,37 @@ elif menu == "Upload Data":
 
     if uploaded_file:
         try:
-            if uploaded_file.name.endswith(".csv"):
-                user_df = pd.read_csv(uploaded_file)
+            # Large CSVs are never loaded whole: only a preview is kept in
+            # memory and analysis/ingestion stream the file in chunks
+            stream_upload = (
+                uploaded_file.name.endswith(".csv")
+                and uploaded_file.size > UPLOAD_STREAM_BYTES
+            )
+            # Parsed uploads are cached by content hash, so widget reruns
+            # (and other users uploading the same file) skip the parsing
+            if stream_upload:
+                user_df = get_cached_upload(
+                    uploaded_file, "preview", lambda: read_upload_preview(uploaded_file)
+                )
+                st.info(
+                    f"Large file ({uploaded_file.size / 1024**2:.0f} MB): the preview shows "
+                    f"the first {len(user_df)} rows, analysis reads the whole file in chunks."
+                )
             else:
-                user_df = pd.read_excel(uploaded_file)
+                user_df, aqi_computed = get_cached_upload(
+                    uploaded_file, "frame", lambda: parse_upload(uploaded_file)
+                )
+                if aqi_computed:
+                    st.info(
+                        "AQI computed from pollutant concentrations (CPCB sub-index method)."
+                    )
+                # That AQI scores each row; saving and ingesting score the
+                # daily means instead
+                upload_rows = (
+                    user_df.drop(columns=["AQI", "Dominant_Pollutant"])
+                    if aqi_computed
+                    else user_df
+                )
 
             st.write("### Data Preview")
             st.dataframe(user_df.head())
@@ -2240,28 +3951,176 @@ elif menu == "Upload Data":
                 )
 
             if st.button("Analyze Uploaded Data"):
-                # Convert date
-                user_df[date_col] = pd.to_datetime(user_df[date_col], errors="coerce")
-                user_df = user_df.dropna(subset=[date_col, val_col])
-                user_df = user_df.sort_values(date_col)
+                if stream_upload:
+                    analyze_progress = st.progress(0.0, text="Reading file...")
+                    user_stats, user_trend = get_cached_upload(
+                        uploaded_file,
+                        ("summary", date_col, val_col),
+                        lambda: stream_upload_summary(
+                            uploaded_file,
+                            date_col,
+                            val_col,
+                            progress=lambda done: analyze_progress.progress(
+                                done, text=f"Reading file... {done:.0%}"
+                            ),
+                        ),
+                    )
+                    analyze_progress.empty()
+
+                    st.markdown(
+                        f"<h3 class='gradient-text'>{val_col} Trend Analysis</h3>",
+                        unsafe_allow_html=True,
+                    )
+                    fig_user = px.line(
+                        user_trend.reset_index(),
+                        x=date_col,
+                        y=val_col,
+                        title=f"{val_col} over Time (mean per period)",
+                    )
+                    st.plotly_chart(fig_user, use_container_width=True)
+
+                    st.write("### Statistics")
+                    st.write(user_stats)
+                    if user_stats["count"] > UPLOAD_SAMPLE_SIZE:
+                        st.caption(
+                            f"Percentiles estimated from a random sample of "
+                            f"{UPLOAD_SAMPLE_SIZE:,} values."
+                        )
+                else:
+                    # Convert date (on a new frame: the parsed upload is shared)
+                    user_df = user_df.assign(
+                        **{date_col: pd.to_datetime(user_df[date_col], errors="coerce")}
+                    )
+                    user_df = user_df.dropna(subset=[date_col, val_col])
+                    user_df = user_df.sort_values(date_col)
 
-                # Plot Trend
+                    # Plot Trend
+                    st.markdown(
+                        f"<h3 class='gradient-text'>{val_col} Trend Analysis</h3>",
+                        unsafe_allow_html=True,
+                    )
+                    fig_user = px.line(
+                        user_df, x=date_col, y=val_col, title=f"{val_col} over Time"
+                    )
+                    st.plotly_chart(fig_user, use_container_width=True)
+
+                    # Stats
+                    st.write("### Statistics")
+                    st.write(user_df[val_col].describe())
+
+            # Save as a named dataset, selectable as the Dashboard data source
+            st.write("---")
+            st.markdown(
+                "<h3 class='gradient-text'>Save as Dataset</h3>",
+                unsafe_allow_html=True,
+            )
+            if stream_upload:
+                st.info(
+                    "Files this large can't be saved as a dataset; "
+                    "ask an admin to ingest them into the database instead."
+                )
+            else:
+                st.write(
+                    "Saves the upload to your account. Pick it under **Data Source** "
+                    "in the sidebar to explore it on the Dashboard."
+                )
+                dataset_name = st.text_input(
+                    "Dataset Name", value=os.path.splitext(uploaded_file.name)[0]
+                ).strip()
+                if st.button("Save Dataset") and dataset_name:
+                    rows, rejected, duplicates, aggregated = save_user_dataset(
+                        st.session_state.user, dataset_name, upload_rows
+                    )
+                    log_user_activity(
+                        st.session_state.user,
+                        f"Saved dataset '{dataset_name}' ({rows} rows)",
+                    )
+                    st.success(f"Saved dataset '{dataset_name}' with {rows} rows.")
+                    if aggregated:
+                        st.info(
+                            f"{aggregated} sub-daily readings were averaged into "
+                            "daily values (CPCB 24-hour / 8-hour averaging)."
+                        )
+                    if duplicates or rejected:
+                        st.warning(
+                            f"{duplicates} repeated City/time rows dropped, "
+                            f"{rejected} rows without a valid City/Date skipped."
+                        )
+
+            # Ingestion into aqi.db (admins only: it changes the shared data)
+            if st.session_state.role == "admin":
+                st.write("---")
                 st.markdown(
-                    f"<h3 class='gradient-text'>{val_col} Trend Analysis</h3>",
+                    "<h3 class='gradient-text'>Ingest into Database</h3>",
                     unsafe_allow_html=True,
                 )
-                fig_user = px.line(
-                    user_df, x=date_col, y=val_col, title=f"{val_col} over Time"
+                st.write(
+                    "Adds new City/Date rows to the AQI database and updates existing ones. "
+                    "Sub-daily readings are averaged into one row per City and day; "
+                    "a repeated City/time row keeps the last occurrence."
                 )
-                st.plotly_chart(fig_user, use_container_width=True)
-
-                # Stats
-                st.write("### Statistics")
-                st.write(user_df[val_col].describe())
+                if st.button("Ingest Uploaded Data"):
+                    ingest_progress = st.progress(0.0, text="Ingesting rows...")
+                    if stream_upload:
+                        uploaded_file.seek(0)
+                        report = ingest_csv(
+                            uploaded_file,
+                            progress=lambda done: ingest_progress.progress(
+                                done, text=f"Ingesting rows... {done:.0%}"
+                            ),
+                        )
+                    else:
+                        report = ingest_air_quality(
+                            upload_rows,
+                            progress=lambda done, total: ingest_progress.progress(
+                                done / total, text=f"Ingesting rows... {done}/{total}"
+                            ),
+                        )
+                    # Pick the new rows up on the next run instead of waiting
+                    # for the periodic refresh
+                    get_data_store()["checked_at"] = 0.0
+                    log_user_activity(
+                        st.session_state.user,
+                        f"Ingested {uploaded_file.name}: {report['inserted']} inserted, "
+                        f"{report['updated']} updated",
+                    )
+                    st.success(
+                        f"Ingested {report['rows']} daily rows: "
+                        f"{report['inserted']} inserted, {report['updated']} updated."
+                    )
+                    if report["aggregated"]:
+                        st.info(
+                            f"{report['aggregated']} sub-daily readings were averaged "
+                            "into daily values (CPCB 24-hour / 8-hour averaging)."
+                        )
+                    if report["duplicates"] or report["rejected"]:
+                        st.warning(
+                            f"{report['duplicates']} repeated City/time rows dropped, "
+                            f"{report['rejected']} rows without a valid City/Date skipped."
+                        )
 
         except Exception as e:
             st.error(f"Error processing file: {e}")
 
+    # Saved datasets of this account
+    my_datasets = list_user_datasets(st.session_state.user)
+    if my_datasets:
+        st.write("---")
+        st.markdown(
+            "<h3 class='gradient-text'>My Datasets</h3>", unsafe_allow_html=True
+        )
+        st.write(", ".join(my_datasets))
+        col_d1, col_d2 = st.columns([3, 1])
+        with col_d1:
+            drop_name = st.selectbox("Select Dataset", list(my_datasets))
+        with col_d2:
+            st.write("")
+            st.write("")
+            if st.button("Delete Dataset"):
+                delete_user_dataset(st.session_state.user, drop_name)
+                log_user_activity(st.session_state.user, f"Deleted dataset '{drop_name}'")
+                st.rerun()
+
 # ---------------- FEEDBACK PAGE ----------------
 elif menu == "Feedback":
     st.markdown(
@@ -2291,14 +4150,11 @@ elif menu == "Feedback":
         submitted = st.form_submit_button("Submit Report")
 
         if submitted:
-            conn = sqlite3.connect("aqi.db")
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO feedback (username, city, issue_type, description) VALUES (?, ?, ?, ?)",
-                (st.session_state.user, f_city, f_issue, f_desc),
-            )
-            conn.commit()
-            conn.close()
+            with transaction() as c:
+                c.execute(
+                    "INSERT INTO feedback (username, city, issue_type, description) VALUES (?, ?, ?, ?)",
+                    (st.session_state.user, f_city, f_issue, f_desc),
+                )
             log_user_activity(st.session_state.user, f"Submitted feedback for {f_city}")
             st.success("Thank you! Your feedback has been recorded.")
 
@@ -2313,13 +4169,12 @@ elif menu == "Profile":
         "<h3 class='gradient-text'>Profile Picture</h3>", unsafe_allow_html=True
     )
 
-    conn = sqlite3.connect("aqi.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT profile_pic FROM users WHERE username=?", (st.session_state.user,)
-    )
-    pic_data = c.fetchone()
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT profile_pic FROM users WHERE username=?", (st.session_state.user,)
+        )
+        pic_data = c.fetchone()
 
     if pic_data and pic_data[0]:
         st.image(pic_data[0], width=150, caption="Your Profile Picture")
@@ -2329,14 +4184,11 @@ elif menu == "Profile":
     )
     if uploaded_pic and st.button("Save Profile Picture"):
         pic_bytes = uploaded_pic.read()
-        conn = sqlite3.connect("aqi.db")
-        c = conn.cursor()
-        c.execute(
-            "UPDATE users SET profile_pic=? WHERE username=?",
-            (pic_bytes, st.session_state.user),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as c:
+            c.execute(
+                "UPDATE users SET profile_pic=? WHERE username=?",
+                (pic_bytes, st.session_state.user),
+            )
         log_user_activity(st.session_state.user, "Updated Profile Picture")
         st.success("Profile picture updated successfully!")
         st.rerun()
@@ -2346,27 +4198,23 @@ elif menu == "Profile":
         "<h3 class='gradient-text'>Notification Settings</h3>", unsafe_allow_html=True
     )
 
-    conn = sqlite3.connect("aqi.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT subscription FROM users WHERE username=?", (st.session_state.user,)
-    )
-    sub_status = c.fetchone()
-    is_subscribed = bool(sub_status[0]) if sub_status else False
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT subscription FROM users WHERE username=?", (st.session_state.user,)
+        )
+        sub_status = c.fetchone()
+        is_subscribed = bool(sub_status[0]) if sub_status else False
 
     new_sub = st.checkbox(
         "Subscribe to Daily AQI Email Reports (09:00 AM)", value=is_subscribed
     )
     if new_sub != is_subscribed:
-        conn = sqlite3.connect("aqi.db")
-        c = conn.cursor()
-        c.execute(
-            "UPDATE users SET subscription=? WHERE username=?",
-            (1 if new_sub else 0, st.session_state.user),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as c:
+            c.execute(
+                "UPDATE users SET subscription=? WHERE username=?",
+                (1 if new_sub else 0, st.session_state.user),
+            )
         st.session_state.daily_report_sub = new_sub
         st.success("Subscription settings updated!")
 
@@ -2383,25 +4231,23 @@ elif menu == "Profile":
         if new_pw != confirm_pw:
             st.error("New passwords do not match!")
         else:
-            conn = sqlite3.connect("aqi.db")
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT password FROM users WHERE username=?", (st.session_state.user,)
-            )
-            row = cursor.fetchone()
+            with connection() as conn:
+                row = conn.execute(
+                    "SELECT password FROM users WHERE username=?",
+                    (st.session_state.user,),
+                ).fetchone()
 
             if row and bcrypt.checkpw(current_pw.encode(), row[0].encode()):
                 new_hashed = bcrypt.hashpw(new_pw.encode(), bcrypt.gensalt()).decode()
-                cursor.execute(
-                    "UPDATE users SET password=? WHERE username=?",
-                    (new_hashed, st.session_state.user),
-                )
-                conn.commit()
+                with transaction() as cursor:
+                    cursor.execute(
+                        "UPDATE users SET password=? WHERE username=?",
+                        (new_hashed, st.session_state.user),
+                    )
                 log_user_activity(st.session_state.user, "Changed Password")
                 st.success("Password updated successfully!")
             else:
                 st.error("Incorrect current password.")
-            conn.close()
 
 # ---------------- USER MANAGEMENT PAGE ----------------
 elif menu == "User Management":
@@ -2410,10 +4256,9 @@ elif menu == "User Management":
         unsafe_allow_html=True,
     )
 
-    conn = sqlite3.connect("aqi.db")
-    # Fetching only ID and Username for security (hiding hashed passwords)
-    users_df = pd.read_sql_query("SELECT id, username FROM users", conn)
-    conn.close()
+    with connection() as conn:
+        # Fetching only ID and Username for security (hiding hashed passwords)
+        users_df = pd.read_sql_query("SELECT id, username FROM users", conn)
 
     st.dataframe(users_df, use_container_width=True)
     st.info(f"Total Registered Users: {len(users_df)}")
@@ -2444,11 +4289,8 @@ elif menu == "User Management":
             )
 
             if st.button("Delete Selected User"):
-                conn = sqlite3.connect("aqi.db")
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM users WHERE username=?", (user_to_delete,))
-                conn.commit()
-                conn.close()
+                with transaction() as cursor:
+                    cursor.execute("DELETE FROM users WHERE username=?", (user_to_delete,))
                 log_user_activity(
                     st.session_state.user, f"Deleted user: {user_to_delete}"
                 )
@@ -2469,14 +4311,11 @@ elif menu == "User Management":
 
     if st.button("Update Password"):
         if new_pw_admin:
-            conn = sqlite3.connect("aqi.db")
-            cursor = conn.cursor()
-            hashed_pw = bcrypt.hashpw(new_pw_admin.encode(), bcrypt.gensalt()).decode()
-            cursor.execute(
-                "UPDATE users SET password=? WHERE username=?", (hashed_pw, u_update)
-            )
-            conn.commit()
-            conn.close()
+            with transaction() as cursor:
+                hashed_pw = bcrypt.hashpw(new_pw_admin.encode(), bcrypt.gensalt()).decode()
+                cursor.execute(
+                    "UPDATE users SET password=? WHERE username=?", (hashed_pw, u_update)
+                )
             log_user_activity(
                 st.session_state.user, f"Admin changed password for: {u_update}"
             )
@@ -2500,13 +4339,10 @@ elif menu == "User Management":
         )
 
     if st.button("Update Role"):
-        conn = sqlite3.connect("aqi.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET role=? WHERE username=?", (new_role_select, u_role_select)
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                "UPDATE users SET role=? WHERE username=?", (new_role_select, u_role_select)
+            )
         log_user_activity(
             st.session_state.user,
             f"Changed role of {u_role_select} to {new_role_select}",
@@ -2521,22 +4357,18 @@ elif menu == "User Management":
         with st.expander("Danger Zone: Clear All Users"):
             st.warning("This action will permanently delete ALL registered users!")
             if st.button("DELETE ALL USERS", type="primary"):
-                conn = sqlite3.connect("aqi.db")
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM users")
-                conn.commit()
-                conn.close()
+                with transaction() as cursor:
+                    cursor.execute("DELETE FROM users")
                 log_user_activity(st.session_state.user, "RESET ALL USERS DATABASE")
                 st.error("All users have been deleted from the database.")
                 st.rerun()
 
     st.write("---")
     st.markdown("<h3 class='gradient-text'>Activity Logs</h3>", unsafe_allow_html=True)
-    conn = sqlite3.connect("aqi.db")
-    logs_df = pd.read_sql_query(
-        "SELECT * FROM activity_logs ORDER BY timestamp DESC", conn
-    )
-    conn.close()
+    with connection() as conn:
+        logs_df = pd.read_sql_query(
+            "SELECT * FROM activity_logs ORDER BY timestamp DESC", conn
+        )
 
     # Improved UI for Logs
     with st.container(height=400):
@@ -2557,11 +4389,10 @@ elif menu == "User Management":
     st.markdown(
         "<h3 class='gradient-text'>User Feedback Reports</h3>", unsafe_allow_html=True
     )
-    conn = sqlite3.connect("aqi.db")
-    feedback_df = pd.read_sql_query(
-        "SELECT * FROM feedback ORDER BY timestamp DESC", conn
-    )
-    conn.close()
+    with connection() as conn:
+        feedback_df = pd.read_sql_query(
+            "SELECT * FROM feedback ORDER BY timestamp DESC", conn
+        )
 
     # Filter by Status
     status_filter = st.radio(
@@ -2608,13 +4439,10 @@ elif menu == "User Management":
 
             if st.button("Mark Selected as Resolved"):
                 if f_ids_to_resolve:
-                    conn = sqlite3.connect("aqi.db")
-                    cursor = conn.cursor()
-                    placeholders = ", ".join("?" for _ in f_ids_to_resolve)
-                    query = f"UPDATE feedback SET status='Resolved' WHERE id IN ({placeholders})"
-                    cursor.execute(query, f_ids_to_resolve)
-                    conn.commit()
-                    conn.close()
+                    with transaction() as cursor:
+                        placeholders = ", ".join("?" for _ in f_ids_to_resolve)
+                        query = f"UPDATE feedback SET status='Resolved' WHERE id IN ({placeholders})"
+                        cursor.execute(query, f_ids_to_resolve)
                     log_user_activity(
                         st.session_state.user,
                         f"Bulk resolved feedback IDs: {f_ids_to_resolve}",
@@ -2782,7 +4610,7 @@ if st.session_state.chat_open:
         if suggested_city and suggested_city in df["City"].values:
             city_df = df[df["City"] == suggested_city].sort_values("Date")
             if not city_df.empty:
-                latest = city_df.iloc[-1]
+                latest = to_display_frame(city_df.tail(1)).iloc[0]
                 avg_aqi = city_df["AQI"].mean()
 
                 context_data = f"""
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+# ---------------- CPCB SUB-INDEX BREAKPOINTS ----------------
+# Indian National AQI (CPCB). Each pollutant's concentration breakpoints map
+# onto the index breakpoints below (µg/m³, CO in mg/m³). The open-ended
+# "Severe" band uses the conventional upper limits so it can be interpolated;
+# readings beyond it extrapolate along the same segment.
+INDEX_BREAKPOINTS = np.array([0, 50, 100, 200, 300, 400, 500], dtype="float64")
+
+CPCB_BREAKPOINTS = {
+    "PM25": [0, 30, 60, 90, 120, 250, 380],
+    "PM10": [0, 50, 100, 250, 350, 430, 510],
+    "NO2": [0, 40, 80, 180, 280, 400, 520],
+    "SO2": [0, 40, 80, 380, 800, 1600, 2400],
+    "CO": [0, 1.0, 2.0, 10, 17, 34, 51],
+    "O3": [0, 50, 100, 168, 208, 748, 1028],
+}
+
+# Averaging period each sub-index is defined on: 24-hour mean, or the
+# maximum 8-hour mean over the last 24 hours for CO and O3
+CPCB_AVERAGING = {
+    "PM25": "24h",
+    "PM10": "24h",
+    "NO2": "24h",
+    "SO2": "24h",
+    "CO": "8h",
+    "O3": "8h",
+}
+
+# An AQI is only reported with at least 3 sub-indices, one of them PM2.5/PM10
+MIN_SUB_INDICES = 3
+PARTICULATES = ("PM25", "PM10")
+
+
+def sub_index(values, pollutant):
+    # Piecewise-linear interpolation of whole arrays; negative or missing
+    # concentrations give NaN
+    bp = np.asarray(CPCB_BREAKPOINTS[pollutant], dtype="float64")
+    x = np.asarray(values, dtype="float64")
+
+    seg = np.clip(np.searchsorted(bp, x, side="left") - 1, 0, len(bp) - 2)
+    lo, hi = bp[seg], bp[seg + 1]
+    i_lo, i_hi = INDEX_BREAKPOINTS[seg], INDEX_BREAKPOINTS[seg + 1]
+
+    index = i_lo + (i_hi - i_lo) * (x - lo) / (hi - lo)
+    return np.where(x >= 0, index, np.nan)
+
+
+def compute_aqi(df):
+    # Sub-index per available pollutant, then AQI = max sub-index and the
+    # pollutant responsible for it. Expects concentrations that are already
+    # averaged (see apply_cpcb_averaging for raw sub-daily readings).
+    pollutants = [p for p in CPCB_BREAKPOINTS if p in df.columns]
+    if not pollutants:
+        raise ValueError(
+            f"No pollutant columns found; expected some of {list(CPCB_BREAKPOINTS)}"
+        )
+
+    sub = np.column_stack(
+        [sub_index(pd.to_numeric(df[p], errors="coerce"), p) for p in pollutants]
+    )
+    valid = ~np.isnan(sub)
+    particulate_cols = [pollutants.index(p) for p in PARTICULATES if p in pollutants]
+    reportable = (valid.sum(axis=1) >= MIN_SUB_INDICES) & valid[
+        :, particulate_cols
+    ].any(axis=1)
+
+    filled = np.where(valid, sub, -np.inf)
+    dominant = filled.argmax(axis=1)
+    aqi = filled[np.arange(len(filled)), dominant]
+
+    result = pd.DataFrame(
+        {f"{p}_SubIndex": sub[:, i] for i, p in enumerate(pollutants)},
+        index=df.index,
+    )
+    result["AQI"] = np.where(reportable, aqi, np.nan)
+    result["Dominant_Pollutant"] = pd.Categorical.from_codes(
+        np.where(reportable, dominant, -1), categories=pollutants
+    )
+    return result
+
+
+def apply_cpcb_averaging(df, time_col="Date", group_col="City"):
+    # Replace raw readings with the averages the sub-indices are defined on,
+    # per station/city and in time order. Rows keep their original order;
+    # rows without a valid timestamp are left as they are. For daily data
+    # the windows only ever contain the row itself, so values are unchanged.
+    pollutants = [p for p in CPCB_BREAKPOINTS if p in df.columns]
+    out = df.copy()
+
+    work = pd.DataFrame(
+        {p: pd.to_numeric(df[p], errors="coerce").to_numpy() for p in pollutants}
+    )
+    work["_key"] = (
+        np.asarray(df[group_col]) if group_col in df.columns else np.zeros(len(df))
+    )
+    work["_time"] = pd.to_datetime(df[time_col], errors="coerce").to_numpy()
+    work["_pos"] = np.arange(len(df))
+    work = work.dropna(subset=["_time"]).sort_values(["_key", "_time"], kind="stable")
+    if work.empty:
+        return out
+
+    timed = work.set_index("_time")
+    grouped = timed.groupby("_key", sort=False, dropna=False)
+    for p in pollutants:
+        if CPCB_AVERAGING[p] == "24h":
+            averaged = grouped[p].rolling("24h").mean().to_numpy()
+        else:
+            timed[f"{p}_8h"] = grouped[p].rolling("8h").mean().to_numpy()
+            averaged = (
+                timed.groupby("_key", sort=False, dropna=False)[f"{p}_8h"]
+                .rolling("24h")
+                .max()
+                .to_numpy()
+            )
+
+        values = pd.to_numeric(out[p], errors="coerce").to_numpy(
+            dtype="float64", copy=True
+        )
+        values[work["_pos"].to_numpy()] = averaged
+        out[p] = values
+
+    return out
+
+
+# ---------------- COMMAND LINE ----------------
+if __name__ == "__main__":
+    # Score a raw CSV/XLSX export the way an upload without an AQI column is:
+    # CPCB averaging per city, then the sub-indices
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compute CPCB AQI for raw pollutant readings in an export."
+    )
+    parser.add_argument("file", help="CSV or XLSX export (City, Date, pollutants)")
+    args = parser.parse_args()
+
+    if str(args.file).lower().endswith((".xlsx", ".xls")):
+        readings = pd.read_excel(args.file)
+    else:
+        readings = pd.read_csv(args.file)
+    if "Date" in readings.columns:
+        readings = apply_cpcb_averaging(readings)
+    scored = compute_aqi(readings)
+    print(
+        f"{args.file}: {int(scored['AQI'].notna().sum())} of {len(scored)} rows "
+        f"scored, mean AQI {scored['AQI'].mean():.1f}"
+    )
+    print(scored["Dominant_Pollutant"].value_counts().to_string())
@@ -0,0 +1,382 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+DB_PATH = "aqi.db"
+
+# ---------------- CONNECTION SETTINGS ----------------
+# WAL lets readers keep going while the scheduler or another session writes;
+# synchronous=NORMAL is durable enough in WAL mode and avoids an fsync per commit.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16384",  # 16 MiB page cache per connection
+    "PRAGMA mmap_size=268435456",  # 256 MiB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+]
+POOL_SIZE = 8
+BUSY_TIMEOUT_SECONDS = 10
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_SECONDS,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# ---------------- POOL ----------------
+@contextmanager
+def connection():
+    # Lease a pooled connection to the calling thread for the duration of the
+    # block. Streamlit runs every rerun on a fresh thread, so connections are
+    # handed between threads but never used by two of them at once; keeping
+    # them open lets each one reuse its prepared statements across reruns.
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+@contextmanager
+def transaction():
+    # Cursor inside a transaction: committed when the block exits normally,
+    # rolled back (and the error re-raised) if it raises
+    with connection() as conn:
+        with conn:
+            yield conn.cursor()
+
+
+def seed_setting(cursor, key, value):
+    # Add a settings row unless it exists. Checked with a SELECT first: INSERT
+    # OR IGNORE takes the write lock even when it ignores the row, and the
+    # migrations seeding settings run on every app rerun.
+    cursor.execute("SELECT 1 FROM settings WHERE key = ?", (key,))
+    if cursor.fetchone() is None:
+        cursor.execute(
+            "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value)
+        )
+
+
+# ---------------- AQI TABLE SCHEMA ----------------
+POLLUTANT_COLUMNS = ["AQI", "PM25", "PM10", "NO2", "SO2", "CO", "O3"]
+
+# Dates are stored as ISO "YYYY-MM-DD" text so they sort and compare correctly,
+# and the UNIQUE (City, Date) constraint doubles as the composite lookup index.
+AIR_QUALITY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        City TEXT NOT NULL,
+        Date TEXT NOT NULL,
+        AQI REAL,
+        PM25 REAL,
+        PM10 REAL,
+        NO2 REAL,
+        SO2 REAL,
+        CO REAL,
+        O3 REAL,
+        UNIQUE (City, Date)
+    )
+"""
+
+
+def migrate_air_quality_schema(cursor):
+    # Also run by headless tools (ingest.py) before the app has created
+    # anything, so make sure the settings table holding the counters exists
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+    )
+
+    cursor.execute("PRAGMA table_info(air_quality)")
+    columns = cursor.fetchall()
+
+    if not columns:
+        cursor.execute(AIR_QUALITY_SCHEMA.format(table="air_quality"))
+    elif not any(col[1] == "id" and col[5] for col in columns):
+        # Legacy table (no primary key, untyped Date): rebuild it in place.
+        # Dates are normalized to ISO, rows without a usable City/Date are
+        # dropped and duplicate (City, Date) pairs keep the last inserted row.
+        cursor.execute("DROP TABLE IF EXISTS air_quality_new")
+        cursor.execute(AIR_QUALITY_SCHEMA.format(table="air_quality_new"))
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO air_quality_new
+                (City, Date, AQI, PM25, PM10, NO2, SO2, CO, O3)
+            SELECT TRIM(City), date(Date), AQI, PM25, PM10, NO2, SO2, CO, O3
+            FROM air_quality
+            WHERE City IS NOT NULL AND date(Date) IS NOT NULL
+            ORDER BY rowid
+        """
+        )
+        cursor.execute("DROP TABLE air_quality")
+        cursor.execute("ALTER TABLE air_quality_new RENAME TO air_quality")
+
+    # Date-only range scans (sidebar date filter, latest-date lookups)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_air_quality_date ON air_quality (Date)"
+    )
+
+    # Updates/deletes bump a generation counter so incremental loaders know
+    # when appending rows past their high-water mark is no longer enough
+    seed_setting(cursor, "air_quality_generation", "0")
+    for event in ("UPDATE", "DELETE"):
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS air_quality_{event.lower()}_generation
+            AFTER {event} ON air_quality
+            BEGIN
+                UPDATE settings SET value = CAST(value AS INTEGER) + 1
+                WHERE key = 'air_quality_generation';
+            END
+        """
+        )
+
+    create_rollup_table(cursor)
+
+
+# ---------------- AQI ROLLUPS ----------------
+# Per city count/sum/sum-of-squares/min/max of every reading, bucketed by
+# month. Keeps means and variances O(cities x buckets) instead of O(rows).
+# Daily figures are the raw rows themselves: (City, Date) is unique, so see
+# ROLLUP_PROJECTION. Only add a grain together with a reader for it: every
+# grain is maintained on each write. Grain -> bucket expression.
+ROLLUP_GRAINS = {
+    "month": "strftime('%Y-%m-01', Date)",
+}
+ROLLUP_STATS = ["n", "sum", "sumsq", "min", "max"]
+ROLLUP_COLUMNS = [f"{p}_{stat}" for p in POLLUTANT_COLUMNS for stat in ROLLUP_STATS]
+
+# A single air_quality row in rollup form, for combining raw days with buckets
+ROLLUP_PROJECTION = ", ".join(
+    f"{p} IS NOT NULL AS {p}_n, {p} AS {p}_sum, {p} * {p} AS {p}_sumsq, "
+    f"{p} AS {p}_min, {p} AS {p}_max"
+    for p in POLLUTANT_COLUMNS
+)
+
+
+def create_rollup_table(cursor):
+    value_columns = ",\n".join(f"            {col} REAL" for col in ROLLUP_COLUMNS)
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS air_quality_rollup (
+            Grain TEXT NOT NULL,
+            City TEXT NOT NULL,
+            Bucket TEXT NOT NULL,
+{value_columns},
+            PRIMARY KEY (Grain, City, Bucket)
+        ) WITHOUT ROWID
+    """
+    )
+    # Drop buckets of grains no longer kept (the day grain gave way to
+    # reading the raw rows; nothing read the week grain). Only when
+    # ROLLUP_GRAINS changed: this runs on every app rerun, and a DELETE would
+    # take the write lock each time.
+    grains = ",".join(ROLLUP_GRAINS)
+    cursor.execute("SELECT value FROM settings WHERE key = 'rollup_grains'")
+    if cursor.fetchone() != (grains,):
+        cursor.execute(
+            "DELETE FROM air_quality_rollup WHERE Grain NOT IN "
+            f"({', '.join('?' for _ in ROLLUP_GRAINS)})",
+            list(ROLLUP_GRAINS),
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES ('rollup_grains', ?)",
+            (grains,),
+        )
+
+
+def rollup_bucket_keys(dates):
+    # ROLLUP_GRAINS bucket starts for ISO date strings, computed in numpy
+    days = pd.to_datetime(dates, format="%Y-%m-%d").to_numpy().astype("datetime64[D]")
+    return {"month": days.astype("datetime64[M]").astype(days.dtype)}
+
+
+def aggregate_rollup_rows(rows, grain):
+    # Rollup rows for one grain from raw readings with a bucket column per grain
+    values = rows[POLLUTANT_COLUMNS].astype("float64")
+    keys = [rows["City"], rows[grain].rename("Bucket")]
+    grouped = values.groupby(keys, sort=False)
+    squares = (values * values).groupby(keys, sort=False)
+    stats = pd.concat(
+        {
+            "n": grouped.count(),
+            "sum": grouped.sum(min_count=1),
+            "sumsq": squares.sum(min_count=1),
+            "min": grouped.min(),
+            "max": grouped.max(),
+        },
+        axis=1,
+    )
+    stats.columns = [f"{p}_{stat}" for stat, p in stats.columns]
+    stats = stats[ROLLUP_COLUMNS].reset_index()
+    stats["Bucket"] = stats["Bucket"].dt.strftime("%Y-%m-%d")
+    stats.insert(0, "Grain", grain)
+    return stats
+
+
+def read_rollup_rows(cursor, query, params=()):
+    # Raw (City, Date, readings) rows plus their bucket keys, one per row
+    cursor.execute(query, params)
+    rows = pd.DataFrame.from_records(
+        cursor.fetchall(), columns=["id", "City", "Date"] + POLLUTANT_COLUMNS
+    ).drop_duplicates(subset="id")
+    return rows.assign(**rollup_bucket_keys(rows["Date"]))
+
+
+def write_rollup_rows(cursor, stats):
+    placeholders = ", ".join("?" for _ in range(3 + len(ROLLUP_COLUMNS)))
+    columns = (stats[col].astype(object).tolist() for col in stats.columns)
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO air_quality_rollup VALUES ({placeholders})",
+        zip(*columns),
+    )
+
+
+def refresh_rollup_buckets(cursor, touched_query=None, params=()):
+    # Recompute every bucket containing a (City, Date) returned by
+    # touched_query, or all buckets when it is None; buckets are rebuilt from
+    # the raw rows, so updates and deletes are handled too. The rows are read
+    # once and aggregated in pandas: as SQL GROUP BYs, the ~35 aggregates per
+    # row and grain made rollup upkeep the slowest part of a bulk write.
+    values = ", ".join(f"a.{p}" for p in POLLUTANT_COLUMNS)
+
+    if touched_query is None:
+        cursor.execute("DELETE FROM air_quality_rollup")
+        rows = read_rollup_rows(
+            cursor, f"SELECT a.id, a.City, a.Date, {values} FROM air_quality a"
+        )
+        for grain in ROLLUP_GRAINS:
+            write_rollup_rows(cursor, aggregate_rollup_rows(rows, grain))
+        return
+
+    cursor.execute("DROP TABLE IF EXISTS temp.rollup_touched")
+    cursor.execute(f"CREATE TEMP TABLE rollup_touched AS {touched_query}", params)
+    rows = read_rollup_rows(
+        cursor,
+        f"""
+        SELECT a.id, a.City, a.Date, {values}
+        FROM (
+            SELECT DISTINCT City, strftime('%Y-%m-01', Date) AS Month
+            FROM temp.rollup_touched
+        ) t
+        JOIN air_quality a
+            ON a.City = t.City
+            AND a.Date >= t.Month
+            AND a.Date < date(t.Month, '+1 month')
+    """,
+    )
+    for grain, expr in ROLLUP_GRAINS.items():
+        cursor.execute(f"SELECT DISTINCT City, {expr} FROM temp.rollup_touched")
+        touched = pd.DataFrame(cursor.fetchall(), columns=["City", "Bucket"])
+        cursor.execute(
+            f"""
+            DELETE FROM air_quality_rollup
+            WHERE Grain = '{grain}' AND (City, Bucket) IN (
+                SELECT DISTINCT City, {expr} FROM temp.rollup_touched
+            )
+        """
+        )
+        stats = aggregate_rollup_rows(rows, grain)
+        write_rollup_rows(cursor, stats.merge(touched, on=["City", "Bucket"]))
+    cursor.execute("DROP TABLE temp.rollup_touched")
+
+
+def merge_rollup_rows(cursor, rows):
+    # Fold rows that are new to air_quality (City, ISO Date, readings) into
+    # their buckets without reading the buckets' other rows back: counts, sums
+    # and sums of squares add up, minima/maxima combine. Rows that replaced or
+    # removed earlier readings need refresh_rollup_buckets instead.
+    if rows.empty:
+        return
+    rows = rows.reindex(columns=["City", "Date"] + POLLUTANT_COLUMNS)
+    rows = rows.assign(**rollup_bucket_keys(rows["Date"]))
+
+    for grain in ROLLUP_GRAINS:
+        stats = aggregate_rollup_rows(rows, grain)
+        cursor.execute(
+            "SELECT * FROM air_quality_rollup WHERE Grain = ? AND Bucket BETWEEN ? AND ?",
+            (grain, stats["Bucket"].min(), stats["Bucket"].max()),
+        )
+        existing = pd.DataFrame.from_records(
+            cursor.fetchall(), columns=["Grain", "City", "Bucket"] + ROLLUP_COLUMNS
+        ).astype(dict.fromkeys(ROLLUP_COLUMNS, "float64"))
+        merged = stats.merge(
+            existing, on=["Grain", "City", "Bucket"], how="left", suffixes=("", "_old")
+        )
+        for p in POLLUTANT_COLUMNS:
+            for stat in ("n", "sum", "sumsq"):
+                col = f"{p}_{stat}"
+                merged[col] = merged[col].add(merged[f"{col}_old"], fill_value=0)
+            merged[f"{p}_min"] = np.fmin(merged[f"{p}_min"], merged[f"{p}_min_old"])
+            merged[f"{p}_max"] = np.fmax(merged[f"{p}_max"], merged[f"{p}_max_old"])
+        write_rollup_rows(cursor, merged[stats.columns])
+
+
+def sync_rollups(cursor):
+    # Bring the rollups up to the current air_quality contents: rows past the
+    # rollup high-water mark are folded into their buckets, a rewrite
+    # generation change (updates/deletes by any writer) rebuilds everything
+    cursor.execute(
+        "SELECT key, value FROM settings WHERE key IN "
+        "('air_quality_generation', 'rollup_generation', 'rollup_high_water')"
+    )
+    state = dict(cursor.fetchall())
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM air_quality")
+    max_id = cursor.fetchone()[0]
+
+    generation = state.get("air_quality_generation")
+    high_water = int(state.get("rollup_high_water", 0))
+
+    if state.get("rollup_generation") != generation:
+        refresh_rollup_buckets(cursor)
+    elif max_id > high_water:
+        columns = ", ".join(["City", "Date"] + POLLUTANT_COLUMNS)
+        cursor.execute(f"SELECT {columns} FROM air_quality WHERE id > ?", (high_water,))
+        merge_rollup_rows(
+            cursor,
+            pd.DataFrame.from_records(
+                cursor.fetchall(), columns=["City", "Date"] + POLLUTANT_COLUMNS
+            ),
+        )
+    else:
+        return
+
+    mark_rollups_synced(cursor)
+
+
+def mark_rollups_synced(cursor):
+    # Record the rollups as matching the current air_quality contents. For
+    # sync_rollups, and for writers that refresh the buckets they touched
+    # themselves in the same transaction (see ingest.py).
+    cursor.execute(
+        "SELECT value FROM settings WHERE key = 'air_quality_generation'"
+    )
+    generation = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM air_quality")
+    max_id = cursor.fetchone()[0]
+
+    cursor.executemany(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+        [("rollup_generation", generation), ("rollup_high_water", str(max_id))],
+    )
@@ -0,0 +1,485 @@
+import argparse
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import db
+from aqi_engine import CPCB_AVERAGING, CPCB_BREAKPOINTS, compute_aqi
+from db import (
+    POLLUTANT_COLUMNS,
+    mark_rollups_synced,
+    merge_rollup_rows,
+    migrate_air_quality_schema,
+    refresh_rollup_buckets,
+    sync_rollups,
+    transaction,
+)
+from stations import migrate_stations_schema, upsert_stations
+
+# ---------------- COLUMN NORMALIZATION ----------------
+# Export headers are matched case-insensitively with punctuation and spaces
+# stripped, so "PM2.5", "pm_2_5" and "PM 2.5" all land in PM25
+COLUMN_ALIASES = {
+    "city": "City",
+    "station": "City",
+    "date": "Date",
+    "datetime": "Date",
+    "timestamp": "Date",
+    "aqi": "AQI",
+    "pm25": "PM25",
+    "pm10": "PM10",
+    "no2": "NO2",
+    "so2": "SO2",
+    "co": "CO",
+    "o3": "O3",
+    "ozone": "O3",
+}
+INGEST_COLUMNS = ["City", "Date"] + POLLUTANT_COLUMNS
+BATCH_SIZE = 50_000  # Rows per executemany call (and per progress update)
+CHUNK_ROWS = 200_000  # Rows read at a time from large CSV exports
+
+
+# CO and O3 sub-indices are defined on the day's highest 8-hour mean, the
+# others on the 24-hour mean (aqi_engine.CPCB_AVERAGING)
+PEAK_8H_POLLUTANTS = [p for p, period in CPCB_AVERAGING.items() if period == "8h"]
+CSV_READ_PROGRESS = 0.8  # Share of ingest_csv's progress for reading the file
+
+
+def clean_readings(df):
+    # Map an uploaded export onto the air_quality columns, one row per
+    # reading: City, Time (full timestamp) and float readings. Returns the
+    # readings plus counts of rows rejected for a missing City/Date and of
+    # exact City/Time repeats dropped (later rows win, as in the legacy table
+    # migration: a re-exported reading replaces the earlier one).
+    renamed = {}
+    for col in df.columns:
+        target = COLUMN_ALIASES.get(re.sub(r"[^0-9a-z]", "", str(col).lower()))
+        if target and target not in renamed.values():
+            renamed[col] = target
+    df = df[list(renamed)].rename(columns=renamed)
+
+    missing = [col for col in ("City", "Date") if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    present = [p for p in POLLUTANT_COLUMNS if p in df.columns]
+    if not present:
+        raise ValueError(
+            f"No pollutant columns found; expected some of {POLLUTANT_COLUMNS}"
+        )
+
+    out = pd.DataFrame(index=df.index)
+    out["City"] = df["City"].astype("string").str.strip()
+    times = pd.to_datetime(df["Date"], errors="coerce")
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_localize(None)
+    out["Time"] = times
+
+    for p in present:
+        values = pd.to_numeric(df[p], errors="coerce").astype("float64")
+        # Negative concentrations/indices are sensor faults, not readings
+        out[p] = values.where(values >= 0)
+
+    valid = out["City"].fillna("").ne("") & out["Time"].notna()
+    rejected = int((~valid).sum())
+    out = out[valid]
+    deduped = out.drop_duplicates(subset=["City", "Time"], keep="last")
+    return deduped.reset_index(drop=True), rejected, len(out) - len(deduped)
+
+
+def daily_partials(readings, context=None):
+    # Per City and ISO Date: count (<col>_n) and sum (<col>_sum) of every
+    # reading, plus the highest 8-hour mean (<col>_max8) of PEAK_8H_POLLUTANTS.
+    # Counts and sums add up and maxima combine, so partials of the same day
+    # from different chunks of an export merge exactly. context holds earlier
+    # readings (the previous chunk's last 8 hours) that only extend the
+    # 8-hour windows and are not counted themselves.
+    columns = [p for p in POLLUTANT_COLUMNS if p in readings.columns]
+    peaks = [p for p in PEAK_8H_POLLUTANTS if p in columns]
+    frame = readings.assign(_context=False)
+    if context is not None and not context.empty:
+        frame = pd.concat([context.assign(_context=True), frame], ignore_index=True)
+
+    if peaks:
+        frame = frame.sort_values(["City", "Time"], kind="stable", ignore_index=True)
+        rolled = (
+            frame.set_index("Time")
+            .groupby("City", sort=False)[peaks]
+            .rolling("8h")
+            .mean()
+        )
+        for p in peaks:
+            frame[f"{p}_max8"] = rolled[p].to_numpy()
+
+    frame = frame[~frame["_context"]]
+    frame = frame.assign(
+        Date=np.datetime_as_string(frame["Time"].to_numpy().astype("datetime64[D]"))
+    )
+    grouped = frame.groupby(["City", "Date"], sort=False)
+    parts = [
+        grouped[columns].count().add_suffix("_n"),
+        grouped[columns].sum(min_count=1).add_suffix("_sum"),
+    ]
+    if peaks:
+        parts.append(grouped[[f"{p}_max8" for p in peaks]].max())
+    return pd.concat(parts, axis=1).reset_index()
+
+
+def daily_means(partials, columns):
+    # One row per City/Date from daily_partials: the mean of each reading,
+    # and for PEAK_8H_POLLUTANTS the day's highest 8-hour mean. A daily export
+    # (one reading per day) comes out unchanged.
+    daily = partials[["City", "Date"]].copy()
+    for col in columns:
+        counts = partials[f"{col}_n"].astype("float64")
+        daily[col] = partials[f"{col}_sum"].astype("float64") / counts.where(counts > 0)
+        if col in PEAK_8H_POLLUTANTS:
+            daily[col] = partials[f"{col}_max8"].astype("float64")
+    return daily
+
+
+def normalize_air_quality(df, score=True):
+    # An uploaded export as air_quality rows: one per City/Date, ISO dates,
+    # float readings. Sub-daily readings (hourly, 15-minute) are averaged the
+    # CPCB way rather than picking one of the day's rows. Returns the daily
+    # frame plus counts of rows rejected for a missing City/Date, of exact
+    # City/Time repeats dropped and of readings folded into another reading's
+    # day. score=False leaves a missing AQI column out instead of computing it.
+    readings, rejected, duplicates = clean_readings(df)
+    columns = [p for p in POLLUTANT_COLUMNS if p in readings.columns]
+    daily = daily_means(daily_partials(readings), columns)
+    aggregated = len(readings) - len(daily)
+
+    scorable = any(p in daily.columns for p in CPCB_BREAKPOINTS)
+    if score and scorable and "AQI" not in daily.columns:
+        daily = daily.assign(AQI=compute_aqi(daily)["AQI"])
+
+    columns = [col for col in INGEST_COLUMNS if col in daily.columns]
+    return daily[columns].reset_index(drop=True), rejected, duplicates, aggregated
+
+
+# ---------------- UPSERT ----------------
+def upsert_daily(clean, batch_size=BATCH_SIZE, progress=None):
+    # Upsert daily rows (as from normalize_air_quality) into air_quality in a
+    # single transaction. Rows are staged with batched executemany calls, then
+    # merged with one INSERT ... ON CONFLICT (City, Date) DO UPDATE, which is
+    # about twice as fast as upserting row by row. Existing rows only get the
+    # columns the export actually has overwritten. progress, if given, is
+    # called as progress(rows_staged, total_rows) after each batch.
+    #
+    # Without an AQI column, AQI is computed from the export's pollutants.
+    # New rows store that; rows that already exist are rescored from their
+    # merged readings instead, so an export carrying only some pollutants
+    # never replaces an AQI based on more sub-indices with a narrower one.
+    scored = "AQI" not in clean.columns and any(
+        p in clean.columns for p in CPCB_BREAKPOINTS
+    )
+    if scored:
+        clean = clean.assign(AQI=compute_aqi(clean)["AQI"])
+    readings = [col for col in POLLUTANT_COLUMNS if col in clean.columns]
+    columns = ["City", "Date"] + readings
+    total = len(clean)
+    report = {"rows": total, "inserted": 0, "updated": 0}
+    if not total:
+        return report
+
+    # Plain Python tuples: NaN readings are stored as NULL by SQLite
+    rows = list(zip(*(clean[col].astype(object).tolist() for col in columns)))
+    column_list = ", ".join(columns)
+    placeholders = ", ".join("?" for _ in columns)
+    updates = ", ".join(
+        f"{col} = excluded.{col}" for col in readings if not (scored and col == "AQI")
+    )
+
+    with transaction() as cursor:
+        migrate_air_quality_schema(cursor)
+        # Bring the rollups current first, so afterwards only the buckets this
+        # export touches need updating
+        sync_rollups(cursor)
+
+        cursor.execute("DROP TABLE IF EXISTS temp.ingest_staging")
+        cursor.execute(
+            f"CREATE TEMP TABLE ingest_staging AS "
+            f"SELECT {column_list} FROM air_quality WHERE 0"
+        )
+        for start in range(0, total, batch_size):
+            cursor.executemany(
+                f"INSERT INTO temp.ingest_staging VALUES ({placeholders})",
+                rows[start : start + batch_size],
+            )
+            if progress:
+                progress(min(start + batch_size, total), total)
+
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM temp.ingest_staging s
+            JOIN air_quality a ON a.City = s.City AND a.Date = s.Date
+        """
+        )
+        report["updated"] = cursor.fetchone()[0]
+        report["inserted"] = total - report["updated"]
+        # AUTOINCREMENT ids: every row the merge inserts comes after this one
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM air_quality")
+        last_existing_id = cursor.fetchone()[0]
+
+        # WHERE true keeps SQLite from parsing ON CONFLICT as a join clause
+        cursor.execute(
+            f"""
+            INSERT INTO air_quality ({column_list})
+            SELECT {column_list} FROM temp.ingest_staging WHERE true
+            ON CONFLICT (City, Date) DO UPDATE SET {updates}
+        """
+        )
+        if scored and report["updated"]:
+            rescore_updated_rows(cursor, last_existing_id)
+
+        # New rows fold straight into their buckets; replaced readings need
+        # the touched buckets recomputed from air_quality
+        if report["updated"]:
+            refresh_rollup_buckets(cursor, "SELECT City, Date FROM temp.ingest_staging")
+        else:
+            merge_rollup_rows(cursor, clean)
+        mark_rollups_synced(cursor)
+        cursor.execute("DROP TABLE temp.ingest_staging")
+
+    return report
+
+
+def rescore_updated_rows(cursor, last_existing_id):
+    # AQI of the staged rows that already existed, from all their readings
+    # after the merge; rows still short of a reportable AQI keep the old one
+    pollutants = list(CPCB_BREAKPOINTS)
+    cursor.execute(
+        f"""
+        SELECT a.id, {", ".join(f"a.{p}" for p in pollutants)}
+        FROM temp.ingest_staging s
+        JOIN air_quality a ON a.City = s.City AND a.Date = s.Date
+        WHERE a.id <= ?
+    """,
+        (last_existing_id,),
+    )
+    merged = pd.DataFrame.from_records(
+        cursor.fetchall(), columns=["id"] + pollutants
+    ).astype(dict.fromkeys(pollutants, "float64"))
+    aqi = compute_aqi(merged)["AQI"]
+    scored = aqi.notna()
+    cursor.executemany(
+        "UPDATE air_quality SET AQI = ? WHERE id = ?",
+        zip(aqi[scored].tolist(), merged.loc[scored, "id"].tolist()),
+    )
+
+
+def ingest_air_quality(df, batch_size=BATCH_SIZE, progress=None):
+    # Validate/normalize an export (sub-daily readings averaged per day) and
+    # upsert it. The report counts daily rows written and rows dropped.
+    clean, rejected, duplicates, aggregated = normalize_air_quality(df, score=False)
+    report = upsert_daily(clean, batch_size=batch_size, progress=progress)
+    report.update(rejected=rejected, duplicates=duplicates, aggregated=aggregated)
+    return report
+
+
+# ---------------- CSV STREAMING ----------------
+def recent_readings(readings, hours=8):
+    # Each city's readings in the last `hours` before its latest one: the
+    # context the next chunk's 8-hour windows need
+    latest = readings.groupby("City", sort=False)["Time"].transform("max")
+    return readings[readings["Time"] > latest - pd.Timedelta(hours=hours)]
+
+
+def create_scratch_tables(scratch):
+    # partials: per-day partials merged across chunks. peak_readings: the raw
+    # PEAK_8H_POLLUTANTS readings, whose 8-hour windows need them in time order
+    peaks = [f"{p}_max8 REAL" for p in PEAK_8H_POLLUTANTS]
+    stats = [f"{p}_n INTEGER, {p}_sum REAL" for p in POLLUTANT_COLUMNS]
+    scratch.execute(
+        f"""
+        CREATE TABLE partials (
+            City TEXT NOT NULL,
+            Date TEXT NOT NULL,
+            {", ".join(stats + peaks)},
+            PRIMARY KEY (City, Date)
+        )
+    """
+    )
+    readings = [f"{p} REAL" for p in PEAK_8H_POLLUTANTS]
+    scratch.execute(
+        f"""
+        CREATE TABLE peak_readings (
+            City TEXT NOT NULL,
+            Time TEXT NOT NULL,
+            {", ".join(readings)}
+        )
+    """
+    )
+
+
+def stage_partials(scratch, partials):
+    # Add a chunk's daily partials to those of earlier chunks (SQLite's
+    # two-argument max() is NULL if either side is, hence the COALESCEs)
+    columns = (
+        ["City", "Date"]
+        + [f"{p}_{stat}" for p in POLLUTANT_COLUMNS for stat in ("n", "sum")]
+        + [f"{p}_max8" for p in PEAK_8H_POLLUTANTS]
+    )
+    partials = partials.reindex(columns=columns)
+    partials[[f"{p}_n" for p in POLLUTANT_COLUMNS]] = (
+        partials[[f"{p}_n" for p in POLLUTANT_COLUMNS]].fillna(0).astype("int64")
+    )
+    merges = [f"{p}_n = {p}_n + excluded.{p}_n" for p in POLLUTANT_COLUMNS]
+    merges += [
+        f"{p}_sum = COALESCE({p}_sum + excluded.{p}_sum, {p}_sum, excluded.{p}_sum)"
+        for p in POLLUTANT_COLUMNS
+    ]
+    merges += [
+        f"{p}_max8 = COALESCE(MAX({p}_max8, excluded.{p}_max8), {p}_max8, "
+        f"excluded.{p}_max8)"
+        for p in PEAK_8H_POLLUTANTS
+    ]
+    scratch.executemany(
+        f"""
+        INSERT INTO partials ({", ".join(columns)})
+        VALUES ({", ".join("?" for _ in columns)})
+        ON CONFLICT (City, Date) DO UPDATE SET {", ".join(merges)}
+    """,
+        zip(*(partials[col].astype(object).tolist() for col in columns)),
+    )
+
+
+def stage_peak_readings(scratch, readings):
+    peaks = readings.reindex(columns=["City", "Time"] + PEAK_8H_POLLUTANTS)
+    peaks = peaks.dropna(subset=PEAK_8H_POLLUTANTS, how="all")
+    # ISO text sorts chronologically
+    peaks["Time"] = peaks["Time"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    scratch.executemany(
+        f"INSERT INTO peak_readings VALUES ({', '.join('?' for _ in peaks.columns)})",
+        zip(*(peaks[col].astype(object).tolist() for col in peaks.columns)),
+    )
+
+
+def stage_peak_partials(scratch, chunk_rows):
+    # 8-hour maxima from the staged CO/O3 readings, read back CHUNK_ROWS at a
+    # time in City/Time order. Each chunk carries the previous one's last 8
+    # hours as window context, so the maxima match a single in-memory pass
+    # whatever the order of the export.
+    cursor = scratch.execute("SELECT * FROM peak_readings ORDER BY City, Time")
+    names = [description[0] for description in cursor.description]
+    context = None
+    while True:
+        batch = cursor.fetchmany(chunk_rows)
+        if not batch:
+            break
+        readings = pd.DataFrame.from_records(batch, columns=names)
+        readings = readings.astype(dict.fromkeys(PEAK_8H_POLLUTANTS, "float64"))
+        readings["Time"] = pd.to_datetime(readings["Time"])
+        # Staging goes through its own cursor, not the one being read
+        stage_partials(scratch, daily_partials(readings, context))
+        context = recent_readings(readings)
+
+
+def ingest_csv(source, chunk_rows=CHUNK_ROWS, batch_size=BATCH_SIZE, progress=None):
+    # Ingest a CSV export CHUNK_ROWS rows at a time, so memory stays bounded
+    # whatever the file size. Each chunk's readings are reduced to per-day
+    # counts and sums accumulated in a private temporary on-disk database, so
+    # a day whose readings span chunks, in any order, still averages all of
+    # them. CO/O3 readings are staged there as they are and their 8-hour
+    # maxima computed once the file is read (stage_peak_partials). The daily
+    # rows are then upserted CHUNK_ROWS at a time. An exact City/Time repeat
+    # in a later chunk counts as another reading. progress, if given, is
+    # called with the fraction done (source must support tell()/size for the
+    # reading part, as Streamlit uploads do).
+    totals = dict.fromkeys(
+        ["rows", "inserted", "updated", "rejected", "duplicates", "aggregated"], 0
+    )
+    readings_read = 0
+    present = set()
+    scratch = sqlite3.connect("")
+    try:
+        create_scratch_tables(scratch)
+        for chunk in pd.read_csv(source, dtype=str, chunksize=chunk_rows):
+            readings, rejected, duplicates = clean_readings(chunk)
+            totals["rejected"] += rejected
+            totals["duplicates"] += duplicates
+            readings_read += len(readings)
+            present.update(p for p in POLLUTANT_COLUMNS if p in readings.columns)
+            peaks = [p for p in PEAK_8H_POLLUTANTS if p in readings.columns]
+            stage_partials(scratch, daily_partials(readings.drop(columns=peaks)))
+            stage_peak_readings(scratch, readings)
+            if progress:
+                read = min(source.tell() / max(source.size, 1), 1.0)
+                progress(CSV_READ_PROGRESS * read)
+        stage_peak_partials(scratch, chunk_rows)
+
+        days = scratch.execute("SELECT COUNT(*) FROM partials").fetchone()[0]
+        totals["aggregated"] = readings_read - days
+        columns = [p for p in POLLUTANT_COLUMNS if p in present]
+        cursor = scratch.execute("SELECT * FROM partials ORDER BY City, Date")
+        names = [description[0] for description in cursor.description]
+        while True:
+            batch = cursor.fetchmany(chunk_rows)
+            if not batch:
+                break
+            partials = pd.DataFrame.from_records(batch, columns=names)
+            partials = partials.astype(dict.fromkeys(names[2:], "float64"))
+            report = upsert_daily(daily_means(partials, columns), batch_size=batch_size)
+            for key in ("rows", "inserted", "updated"):
+                totals[key] += report[key]
+            if progress:
+                progress(
+                    CSV_READ_PROGRESS
+                    + (1 - CSV_READ_PROGRESS) * totals["rows"] / max(days, 1)
+                )
+    finally:
+        scratch.close()
+    return totals
+
+
+def read_export(path):
+    # Excel monitoring export (CSVs are streamed through ingest_csv instead)
+    return pd.read_excel(path)
+
+
+# ---------------- STATIONS ----------------
+def ingest_stations(df):
+    # Register/move the stations in a registry export (City, Lat, Lon and any
+    # metadata columns); returns (stations written, rows rejected)
+    with transaction() as cursor:
+        migrate_stations_schema(cursor)
+        return upsert_stations(cursor, df)
+
+
+# ---------------- COMMAND LINE ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upsert CSV/XLSX monitoring exports into the air_quality table."
+    )
+    parser.add_argument("files", nargs="+", help="CSV or XLSX export(s) to ingest")
+    parser.add_argument("--db", default=db.DB_PATH, help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--stations",
+        action="store_true",
+        help="Files are station registries (City, Lat, Lon, extra columns as metadata)",
+    )
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    for path in args.files:
+        if args.stations:
+            if str(path).lower().endswith((".xlsx", ".xls")):
+                registry = pd.read_excel(path)
+            else:
+                registry = pd.read_csv(path)
+            written, rejected = ingest_stations(registry)
+            print(f"{path}: {written} stations registered ({rejected} rows rejected)")
+            continue
+        if str(path).lower().endswith((".xlsx", ".xls")):
+            report = ingest_air_quality(read_export(path), batch_size=args.batch_size)
+        else:
+            report = ingest_csv(path, batch_size=args.batch_size)
+        print(
+            f"{path}: {report['inserted']} inserted, {report['updated']} updated "
+            f"({report['aggregated']} sub-daily readings averaged into days, "
+            f"{report['duplicates']} repeated City/time rows dropped, "
+            f"{report['rejected']} rows without City/Date rejected)"
+        )
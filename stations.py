@@ -0,0 +1,339 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from db import seed_setting
+
+# ---------------- STATION REGISTRY ----------------
+# Monitoring stations, keyed by the City name their readings carry in
+# air_quality. Anything beyond City/Lat/Lon is kept as JSON in Metadata.
+STATIONS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS stations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        City TEXT NOT NULL UNIQUE,
+        Lat REAL NOT NULL,
+        Lon REAL NOT NULL,
+        Metadata TEXT
+    )
+"""
+
+# Seeded into a freshly created table (the app's original city list)
+DEFAULT_STATIONS = {
+    "Ahmedabad": [23.0225, 72.5714],
+    "Aizawl": [23.7271, 92.7176],
+    "Amaravati": [16.5417, 80.5158],
+    "Amritsar": [31.6340, 74.8723],
+    "Bengaluru": [12.9716, 77.5946],
+    "Bhopal": [23.2599, 77.4126],
+    "Brajrajnagar": [21.8333, 83.9167],
+    "Chandigarh": [30.7333, 76.7794],
+    "Chennai": [13.0827, 80.2707],
+    "Coimbatore": [11.0168, 76.9558],
+    "Delhi": [28.6139, 77.2090],
+    "Ernakulam": [9.9816, 76.2999],
+    "Gurugram": [28.4595, 77.0266],
+    "Guwahati": [26.1445, 91.7362],
+    "Hyderabad": [17.3850, 78.4867],
+    "Jaipur": [26.9124, 75.7873],
+    "Jorapokhar": [23.7000, 86.4100],
+    "Kochi": [9.9312, 76.2673],
+    "Kolkata": [22.5726, 88.3639],
+    "Lucknow": [26.8467, 80.9462],
+    "Mumbai": [19.0760, 72.8777],
+    "Patna": [25.5941, 85.1376],
+    "Shillong": [25.5788, 91.8933],
+    "Talcher": [20.9500, 85.2167],
+    "Thiruvananthapuram": [8.5241, 76.9366],
+    "Visakhapatnam": [17.6868, 83.2185],
+}
+
+# Registry file headers, matched like ingest.COLUMN_ALIASES
+STATION_COLUMN_ALIASES = {
+    "city": "City",
+    "station": "City",
+    "name": "City",
+    "lat": "Lat",
+    "latitude": "Lat",
+    "lon": "Lon",
+    "lng": "Lon",
+    "long": "Lon",
+    "longitude": "Lon",
+}
+
+
+def migrate_stations_schema(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    cursor.execute("PRAGMA table_info(stations)")
+    if not cursor.fetchall():
+        cursor.execute(STATIONS_SCHEMA)
+        cursor.executemany(
+            "INSERT INTO stations (City, Lat, Lon) VALUES (?, ?, ?)",
+            [(city, lat, lon) for city, (lat, lon) in DEFAULT_STATIONS.items()],
+        )
+
+    # Any change bumps a generation counter, the cache key of the app's index
+    seed_setting(cursor, "stations_generation", "0")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS stations_{event.lower()}_generation
+            AFTER {event} ON stations
+            BEGIN
+                UPDATE settings SET value = CAST(value AS INTEGER) + 1
+                WHERE key = 'stations_generation';
+            END
+        """
+        )
+
+
+def stations_generation(cursor):
+    row = cursor.execute(
+        "SELECT value FROM settings WHERE key = 'stations_generation'"
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def read_stations(cursor):
+    cursor.execute("SELECT id, City, Lat, Lon, Metadata FROM stations ORDER BY id")
+    return pd.DataFrame.from_records(
+        cursor.fetchall(), columns=["id", "City", "Lat", "Lon", "Metadata"]
+    )
+
+
+def normalize_stations(df):
+    # Map a station registry export onto City/Lat/Lon/Metadata. Returns the
+    # clean frame (last row wins per City) and the count of rows rejected for
+    # a missing name or out-of-range coordinates.
+    renamed = {}
+    for col in df.columns:
+        target = STATION_COLUMN_ALIASES.get(re.sub(r"[^0-9a-z]", "", str(col).lower()))
+        if target and target not in renamed.values():
+            renamed[col] = target
+    missing = [col for col in ("City", "Lat", "Lon") if col not in renamed.values()]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    extra = df.drop(columns=list(renamed))
+    df = df[list(renamed)].rename(columns=renamed)
+
+    out = pd.DataFrame(index=df.index)
+    out["City"] = df["City"].astype("string").str.strip()
+    out["Lat"] = pd.to_numeric(df["Lat"], errors="coerce").astype("float64")
+    out["Lon"] = pd.to_numeric(df["Lon"], errors="coerce").astype("float64")
+    out["Metadata"] = (
+        [
+            json.dumps({str(k): v for k, v in row.items() if pd.notna(v)}, default=str)
+            for row in extra.to_dict("records")
+        ]
+        if len(extra.columns)
+        else None
+    )
+
+    valid = (
+        out["City"].fillna("").ne("")
+        & out["Lat"].between(-90, 90)
+        & out["Lon"].between(-180, 180)
+    )
+    clean = out[valid].drop_duplicates(subset="City", keep="last")
+    return clean.reset_index(drop=True), int((~valid).sum())
+
+
+def upsert_stations(cursor, df):
+    # Register or move stations; Metadata is only replaced when the export
+    # has extra columns. Returns the number of stations written and rejected.
+    clean, rejected = normalize_stations(df)
+    cursor.executemany(
+        """
+        INSERT INTO stations (City, Lat, Lon, Metadata) VALUES (?, ?, ?, ?)
+        ON CONFLICT (City) DO UPDATE SET
+            Lat = excluded.Lat,
+            Lon = excluded.Lon,
+            Metadata = COALESCE(excluded.Metadata, Metadata)
+    """,
+        zip(*(clean[col].astype(object).tolist() for col in clean.columns)),
+    )
+    return len(clean), rejected
+
+
+# ---------------- SPATIAL INDEX ----------------
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+GRID_CELL_DEGREES = 0.5
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(v, dtype="float64")) for v in (lat1, lon1, lat2, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class StationIndex:
+    # Stations bucketed on a fixed lat/lon grid. Positions are sorted by
+    # (grid row, grid column), so the cells of one grid row inside a bounding
+    # box are a single contiguous slice found with two binary searches; a box
+    # query costs O(grid rows spanned x log n) before the exact filter.
+
+    def __init__(self, stations, cell_degrees=GRID_CELL_DEGREES):
+        self.stations = stations.reset_index(drop=True)
+        self.lats = self.stations["Lat"].to_numpy(dtype="float64")
+        self.lons = self.stations["Lon"].to_numpy(dtype="float64")
+        self._cities = pd.Index(self.stations["City"].astype(str))
+        self._cell = cell_degrees
+        self._columns = int(np.ceil(360 / cell_degrees)) + 1
+        keys = self._grid_row(self.lats) * self._columns + self._grid_column(self.lons)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _grid_row(self, lat):
+        return np.floor((np.asarray(lat) + 90) / self._cell).astype("int64")
+
+    def _grid_column(self, lon):
+        return np.floor((np.asarray(lon) + 180) / self._cell).astype("int64")
+
+    # Coordinate joins
+    def locate(self, cities):
+        # Lat/Lon arrays for a sequence of names; unregistered names get -1
+        # from get_indexer, which picks out the NaN appended to each array
+        positions = self._cities.get_indexer(pd.Index(cities).astype(str))
+        return (
+            np.append(self.lats, np.nan)[positions],
+            np.append(self.lons, np.nan)[positions],
+        )
+
+    def coordinates(self, city):
+        # [lat, lon] of one station, or None
+        position = self._cities.get_indexer([str(city)])[0]
+        if position < 0:
+            return None
+        return [self.lats[position], self.lons[position]]
+
+    def join(self, df, city_col="City"):
+        lats, lons = self.locate(df[city_col])
+        return df.assign(Lat=lats, Lon=lons)
+
+    # Spatial queries
+    def in_bbox(self, south, west, north, east):
+        # Positions of the stations inside a lat/lon box (no antimeridian wrap)
+        west_col, east_col = self._grid_column([west, east])
+        rows = np.arange(self._grid_row(south), self._grid_row(north) + 1)
+        starts = np.searchsorted(self._keys, rows * self._columns + west_col, "left")
+        ends = np.searchsorted(self._keys, rows * self._columns + east_col, "right")
+        candidates = np.concatenate(
+            [self._order[lo:hi] for lo, hi in zip(starts, ends)]
+            + [np.empty(0, dtype="int64")]
+        )
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        return np.sort(candidates[inside])
+
+    def within(self, lat, lon, radius_km, cities=None):
+        # Stations within radius_km of a point (optionally only those named in
+        # cities), nearest first, with a Distance_km column
+        dlat = radius_km / KM_PER_DEGREE
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        widest = np.cos(np.radians(max(abs(south), abs(north))))
+        if north >= 90 or south <= -90 or dlat / max(widest, 1e-9) >= 180:
+            west, east = -180.0, 180.0
+        else:
+            dlon = dlat / widest
+            west, east = max(lon - dlon, -180.0), min(lon + dlon, 180.0)
+        candidates = self.in_bbox(south, west, north, east)
+        if cities is not None:
+            candidates = candidates[self._cities[candidates].isin(list(cities))]
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        keep = distances <= radius_km
+        order = np.argsort(distances[keep], kind="stable")
+        result = self.stations.iloc[candidates[keep][order]].copy()
+        result["Distance_km"] = distances[keep][order]
+        return result
+
+    def nearest(self, lat, lon, k=1, cities=None):
+        # The k nearest stations: search radius doubles until it holds k of
+        # them (every station within a radius is found, so those are exact)
+        radius = self._cell * KM_PER_DEGREE
+        while True:
+            found = self.within(lat, lon, radius, cities)
+            if len(found) >= k or radius >= np.pi * EARTH_RADIUS_KM:
+                return found.head(k)
+            radius *= 2
+
+
+# ---------------- VIEWPORT CLUSTERING ----------------
+# Web Mercator pixel geometry, as used by Leaflet (256 px tiles). Clusters are
+# the CLUSTER_CELL_PX squares of the pixel grid at a zoom level, so a cell at
+# one zoom holds exactly four at the next (a quadtree), and a viewport can
+# never show more than (width / cell) x (height / cell) markers.
+TILE_SIZE_PX = 256
+CLUSTER_CELL_PX = 60
+MAX_MERCATOR_LAT = 85.05112878
+MAX_VIEW_ZOOM = 12
+
+
+def mercator_y(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def world_pixels(lats, lons, zoom):
+    scale = TILE_SIZE_PX * 2.0**zoom
+    lats = np.clip(
+        np.asarray(lats, dtype="float64"), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT
+    )
+    x = (np.asarray(lons, dtype="float64") + 180) / 360 * scale
+    y = (1 - mercator_y(lats) / np.pi) / 2 * scale
+    return x, y
+
+
+def pixels_to_latlon(x, y, zoom):
+    scale = TILE_SIZE_PX * 2.0**zoom
+    lons = np.asarray(x, dtype="float64") / scale * 360 - 180
+    merc = np.pi * (1 - 2 * np.asarray(y, dtype="float64") / scale)
+    return np.degrees(2 * np.arctan(np.exp(merc)) - np.pi / 2), lons
+
+
+def viewport_bounds(lat, lon, zoom, width_px, height_px):
+    # (south, west, north, east) seen by a width x height map centred on a point
+    x, y = world_pixels(lat, lon, zoom)
+    south, west = pixels_to_latlon(x - width_px / 2, y + height_px / 2, zoom)
+    north, east = pixels_to_latlon(x + width_px / 2, y - height_px / 2, zoom)
+    return (
+        float(south),
+        float(max(west, -180.0)),
+        float(north),
+        float(min(east, 180.0)),
+    )
+
+
+def fit_view(lats, lons, width_px, height_px, max_zoom=MAX_VIEW_ZOOM):
+    # Centre and the closest whole zoom at which every point is on screen
+    x, y = world_pixels(lats, lons, 0)
+    span_x = max(x.max() - x.min(), 1e-9)
+    span_y = max(y.max() - y.min(), 1e-9)
+    # Keep a marker's width of margin on every side
+    fit = min(
+        (width_px - 2 * CLUSTER_CELL_PX) / span_x,
+        (height_px - 2 * CLUSTER_CELL_PX) / span_y,
+    )
+    zoom = int(np.clip(np.floor(np.log2(max(fit, 1e-9))), 0, max_zoom))
+    lat, lon = pixels_to_latlon((x.max() + x.min()) / 2, (y.max() + y.min()) / 2, 0)
+    return float(lat), float(lon), zoom
+
+
+def cluster_points(lats, lons, zoom, cell_px=CLUSTER_CELL_PX):
+    # Cluster number of each point: points in the same cell_px square of the
+    # pixel grid at this zoom share one
+    x, y = world_pixels(lats, lons, zoom)
+    cells = np.column_stack(
+        [np.floor(x / cell_px).astype("int64"), np.floor(y / cell_px).astype("int64")]
+    )
+    return np.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)